@@ -0,0 +1,211 @@
+''' Benchmarks for teamo.database.
+
+Run all benchmarks with `python benchmarks/bench_database.py`, or a subset with
+e.g. `python benchmarks/bench_database.py get_all_entries`.
+'''
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+import aiosqlite
+
+# Import teamo from this checkout when run as a script from any directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from teamo import models
+from teamo.database import Database, STORAGE_PROFILES
+
+
+MEMBERS_PER_ENTRY = 5
+
+
+async def populate(db: Database, num_entries: int, num_servers: int = 10):
+    ''' Fills the database with num_entries entries spread over num_servers servers '''
+    for server_id in range(num_servers):
+        await db.insert_settings(server_id, models.Settings())
+
+    start_date = int((datetime.now() + timedelta(hours=1)).timestamp())
+    entry_rows = [
+        (entry_id, entry_id, entry_id % num_servers, "Benchmark game", start_date, 5)
+        for entry_id in range(num_entries)
+    ]
+    member_rows = [
+        (entry_id, member_id, 1)
+        for entry_id in range(num_entries)
+        for member_id in range(MEMBERS_PER_ENTRY)
+    ]
+    async with db.pool.acquire() as conn:
+        await conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)", entry_rows)
+        await conn.executemany("INSERT INTO members VALUES (?, ?, ?)", member_rows)
+        await conn.commit()
+
+
+async def get_entry_four_queries(db: Database, message_id: int) -> models.Entry:
+    ''' The get_entry implementation prior to the single query version '''
+    async with db.pool.acquire() as conn:
+        return await _get_entry_four_queries(db, message_id, conn)
+
+
+async def _get_entry_four_queries(db: Database, message_id: int, conn: aiosqlite.Connection) -> models.Entry:
+    server_id = await db.get_entry_server_id(message_id, db=conn)
+    settings = await db.load_settings(server_id, db=conn)
+    cursor = await conn.execute("SELECT * FROM entries WHERE entry_id=?", (message_id,))
+    entry = models.Entry.create_from_timestamp(*(await cursor.fetchone()), tzinfo=settings.get_tzinfo())
+    cursor = await conn.execute("SELECT member_id, num_players FROM members WHERE entry_id=?", (message_id,))
+    for row in await cursor.fetchall():
+        entry.members.append(models.Member(*row))
+    return entry
+
+
+async def get_entries_one_by_one(db: Database) -> List[models.Entry]:
+    ''' The get_all_entries implementation prior to the bulk loader, with
+    one query for the entry IDs and four queries per entry '''
+    async with db.pool.acquire() as conn:
+        cursor = await conn.execute("SELECT entry_id FROM entries")
+        rows = await cursor.fetchall()
+        return [await _get_entry_four_queries(db, row[0], conn) for row in rows]
+
+
+async def _edit_or_insert_member_select(entry_id: int, member: models.Member, db: aiosqlite.Connection) -> int:
+    ''' The edit_or_insert_member write prior to the UPSERT, with a SELECT
+    followed by an INSERT or an UPDATE '''
+    cursor = await db.execute(
+        "SELECT * FROM members WHERE entry_id=? AND member_id=?", (entry_id, member.user_id))
+    row = await cursor.fetchone()
+    if row is None:
+        await db.execute("INSERT INTO members VALUES (?, ?, ?)", (entry_id, member.user_id, member.num_players))
+        return None
+    await db.execute(
+        "UPDATE members SET num_players=? WHERE entry_id=? AND member_id=?",
+        (member.num_players, entry_id, member.user_id))
+    return row[2]
+
+
+async def edit_or_insert_member_select(db: Database, entry_id: int, member: models.Member) -> int:
+    return await db.write_queue.submit(partial(_edit_or_insert_member_select, entry_id, member))
+
+
+async def timed(coro) -> float:
+    tic = perf_counter()
+    await coro
+    return perf_counter() - tic
+
+
+async def bench_get_all_entries(num_entries: int):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = Database(f"{tmpdirname}/bench.db")
+        await db.init()
+        await populate(db, num_entries)
+
+        one_by_one = await timed(get_entries_one_by_one(db))
+        bulk = await timed(db.get_all_entries())
+        print(f"get_all_entries ({num_entries} entries): one by one {one_by_one:.3f} s, bulk {bulk:.3f} s ({one_by_one / bulk:.1f}x)")
+        await db.close()
+
+
+async def bench_get_entry(num_entries: int, num_lookups: int = 1000):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = Database(f"{tmpdirname}/bench.db")
+        await db.init()
+        await populate(db, num_entries)
+        message_ids = [i * num_entries // num_lookups for i in range(num_lookups)]
+
+        async def lookup(get_entry):
+            for message_id in message_ids:
+                await get_entry(message_id)
+
+        four_queries = await timed(lookup(lambda message_id: get_entry_four_queries(db, message_id)))
+        one_query = await timed(lookup(db.get_entry))
+        print(
+            f"get_entry ({num_entries} entries, {num_lookups} lookups): "
+            f"four queries {four_queries / num_lookups * 1e6:.0f} us/entry, "
+            f"one query {one_query / num_lookups * 1e6:.0f} us/entry ({four_queries / one_query:.1f}x)")
+        await db.close()
+
+
+async def bench_concurrent_reactions(profile_name: str, num_entries: int = 100, num_reactions: int = 2000):
+    ''' Concurrent member registrations, each followed by a read of the entry like a reaction event '''
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = Database(f"{tmpdirname}/bench.db", storage_profile=STORAGE_PROFILES[profile_name])
+        await db.init()
+        await populate(db, num_entries)
+
+        async def react(i: int):
+            entry_id = i % num_entries
+            await db.edit_or_insert_member(entry_id, models.Member(MEMBERS_PER_ENTRY + i, 1 + i % 5))
+            await db.get_entry(entry_id)
+
+        elapsed = await timed(asyncio.gather(*[react(i) for i in range(num_reactions)]))
+        print(f"concurrent reactions ({profile_name} profile): {num_reactions / elapsed:.0f} reactions/s")
+        await db.close()
+
+
+async def bench_edit_or_insert_member(num_entries: int = 100, num_reactions: int = 5000):
+    ''' Concurrent registrations where every second reaction changes an existing
+    registration. Both versions go through the write queue. '''
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db = Database(f"{tmpdirname}/bench.db")
+        await db.init()
+        await populate(db, num_entries)
+
+        def reactions():
+            return [
+                (i % num_entries, models.Member(MEMBERS_PER_ENTRY + i // 2, 1 + i % 5))
+                for i in range(num_reactions)
+            ]
+
+        select = await timed(asyncio.gather(*[
+            edit_or_insert_member_select(db, entry_id, member) for entry_id, member in reactions()]))
+        async with db.pool.acquire() as conn:
+            await conn.execute(f"DELETE FROM members WHERE member_id >= {MEMBERS_PER_ENTRY}")
+            await conn.commit()
+        upsert = await timed(asyncio.gather(*[
+            db.edit_or_insert_member(entry_id, member) for entry_id, member in reactions()]))
+        print(
+            f"edit_or_insert_member ({num_reactions} reactions): "
+            f"select and insert/update {num_reactions / select:.0f} reactions/s, "
+            f"upsert {num_reactions / upsert:.0f} reactions/s ({select / upsert:.2f}x)")
+        await db.close()
+
+
+BENCHMARKS = {
+    "get_all_entries": lambda: [bench_get_all_entries(n) for n in (1000, 10000)],
+    "get_entry": lambda: [bench_get_entry(n) for n in (1000, 10000)],
+    "edit_or_insert_member": lambda: [bench_edit_or_insert_member()],
+    "storage_profiles": lambda: [bench_concurrent_reactions(name) for name in STORAGE_PROFILES.keys()],
+}
+
+
+async def run(names: List[str]):
+    for name in names:
+        for benchmark in BENCHMARKS[name]():
+            await benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Teamo database benchmarks.")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        default=list(BENCHMARKS.keys()),
+        help=f"the benchmarks to run, any of {', '.join(BENCHMARKS.keys())} (default: all)"
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    # Slow pool waits are expected when flooding the database
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args.benchmarks))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,7 @@ setup(
     install_requires=[
         'aiosqlite',
         'dateparser',
-        'discord.py~=1.4',
+        'discord.py~=1.6',
         'python-dotenv',
         'setuptools'
     ],
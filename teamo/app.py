@@ -1,6 +1,7 @@
 import re
-from datetime import datetime, timedelta
-from typing import Dict
+from datetime import datetime, timedelta, timezone
+from typing import Coroutine, Dict, List, Set, Tuple
+from collections import defaultdict
 import asyncio
 import traceback
 from pathlib import Path
@@ -9,7 +10,7 @@ import sys
 import argparse
 import logging
 import dataclasses
-from time import perf_counter
+from time import time
 
 # Third party imports
 import discord
@@ -20,113 +21,351 @@ from dotenv import load_dotenv
 import pkg_resources
 
 # Internal imports
-from teamo import models, utils, database, teamcreation, help
+from teamo import models, utils, database, teamcreation, help, scheduler, concurrency, jobs, state, store
 
 
 class Teamo(commands.Cog):
-    def __init__(self, bot: commands.Bot, database_name):
+    def __init__(self, bot: commands.Bot, database_name, storage_profile: database.StorageProfile):
         self.bot = bot
         Path("db").mkdir(exist_ok=True)
-        self.db = database.Database(database_name)
-        self.cached_messages: Dict[int, discord.Message] = dict()
-        self.locks: Dict[int, asyncio.Lock] = dict()
-        self.cancel_tasks: Dict[int, asyncio.Task] = dict()
+        self.db = database.Database(database_name, storage_profile=storage_profile)
+        # Runtime state of the active entries. Messages are edited and deleted
+        # through partial messages created from the state's message handle,
+        # and the reactions are tracked from the gateway events, so full
+        # messages are only fetched to verify that they still exist on startup.
+        self.entries = state.EntryRegistry(self.handle_entry_events)
+        # All entries in the database, including entries that are being
+        # verified on startup. Entries are read from the store and written
+        # through it, and it is used to ignore events for messages that
+        # aren't Teamo messages without querying the database.
+        self.store = store.EntryStore(self.db)
+        self.jobs = jobs.JobExecutor(self.db, {
+            models.JobKind.CANCEL_ENTRY: self.run_cancel_jobs,
+            models.JobKind.DELETE_MESSAGE: self.run_delete_jobs
+        })
+        # Counters for the edits sent and the edits skipped because the
+        # fingerprint of the embed was unchanged
+        self.num_edits_sent: int = 0
+        self.num_edits_skipped: int = 0
+        self.finish_scheduler = scheduler.DeadlineScheduler(max_sleep=utils.get_check_interval())
+        self.refresh_scheduler = scheduler.DeadlineScheduler()
+        # Edits requested by reactions, delayed so that reactions arriving
+        # close together are shown with one edit
+        self.edit_scheduler = scheduler.DeadlineScheduler()
+        # Discord rate limits message edits per channel, so edits are run
+        # one at a time per channel, with a bound on the total concurrency
+        self.edit_limiter = concurrency.KeyedLimiter(per_key=1, total=10)
         self.startup_done: asyncio.Event
-        self.bot.help_command = help.TeamoHelpCommand(self.db)
-
-    async def delete_entry(self, message_id: int):
-        async with self.locks[message_id]:
-            # Delete message from db
-            await self.db.delete_entry(message_id)
+        # discord.py calls on_ready again after reconnecting, but the timers
+        # and the job executor must only be started once
+        self.background_tasks_started: bool = False
+        # References to the background tasks, which asyncio only holds weakly
+        self.background_tasks: Set[asyncio.Task] = set()
+        # Entries whose Discord messages are being looked up during startup
+        self.pending_verification: Dict[int, asyncio.Event] = dict()
+        self.bot.help_command = help.TeamoHelpCommand(self.db, self.jobs)
+
+    async def close(self):
+        await self.db.close()
+
+    async def delete_entry(self, message_id: int, reason: str):
+        # Move entry to the archive
+        message = self.get_partial_message(message_id)
+        self.evict_entry(message_id)
+        await self.store.archive(message_id, reason)
+
+        # Delete message from discord
+        if message is not None:
+            await message.delete()
+
+    async def archive_deleted_entry(self, message_id: int):
+        '''Archives the entry of a Teamo message that was deleted by someone else'''
+        self.evict_entry(message_id)
+        await self.store.archive(message_id, "deleted")
+
+    def evict_entry(self, message_id: int):
+        '''Drops the runtime state of an entry that has ended'''
+        self.finish_scheduler.unschedule(message_id)
+        self.refresh_scheduler.unschedule(message_id)
+        self.edit_scheduler.unschedule(message_id)
+        self.entries.evict(message_id)
+
+    def get_partial_message(self, message_id: int) -> discord.PartialMessage:
+        '''Returns a partial message for the Teamo message, or None if the
+        entry isn't active or its channel no longer exists'''
+        entry_state = self.entries.get(message_id)
+        if entry_state is None:
+            return None
+        handle = entry_state.handle
+        channel: discord.TextChannel = self.bot.get_channel(handle.channel_id)
+        if channel is None:
+            return None
+        return channel.get_partial_message(handle.message_id)
+
+    async def start_cancel(self, entry_state: state.EntryState, entry: models.Entry):
+        cancel_delay = await self.db.get_setting(entry.server_id, models.SettingsType.CANCEL_DELAY)
+        job = await self.jobs.schedule(models.JobKind.CANCEL_ENTRY, entry.channel_id, entry.message_id, cancel_delay)
+        entry_state.cancel_job_id = job.job_id
+
+    async def abort_cancel(self, entry_state: state.EntryState) -> bool:
+        job_id = entry_state.cancel_job_id
+        if job_id is None:
+            return False
+        entry_state.cancel_job_id = None
+        await self.jobs.cancel(job_id)
+        return True
+
+    async def run_cancel_jobs(self, cancel_jobs: List[models.Job]):
+        # Entries that are being verified on startup are cancelled when they
+        # have been found, without holding up the other jobs
+        for job in cancel_jobs:
+            self.start_background_task(self.send_cancel(job))
+
+    async def send_cancel(self, job: models.Job):
+        if not await self.wait_until_verified(job.message_id):
+            return
+        self.entries.send(job.message_id, state.EntryEvent(state.EntryEventKind.CANCEL, job_id=job.job_id))
 
-            # Delete message from discord
-            await self.cached_messages[message_id].delete()
-            self.cached_messages[message_id] = None
+    def start_background_task(self, coro: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
 
-    async def cancel_after(self, message_id: int):
-        entry = await self.db.get_entry(message_id)
-        cancel_delay = await self.db.get_setting(entry.server_id, models.SettingsType.CANCEL_DELAY)
-        try:
-            await asyncio.sleep(cancel_delay)
-        except asyncio.CancelledError:
+    async def delete_later(self, message: discord.Message, delay: int):
+        '''Deletes the message after delay seconds, even if Teamo is restarted
+        in between. < 0 -> The message is never deleted.'''
+        if delay < 0:
             return
-        await self.delete_entry(message_id)
+        await self.jobs.schedule(models.JobKind.DELETE_MESSAGE, message.channel.id, message.id, delay)
+
+    async def run_delete_jobs(self, delete_jobs: List[models.Job]):
+        # Discord can bulk delete 2-100 messages per call, as long as they
+        # are less than 14 days old. Other messages are deleted one by one.
+        bulk_min_id = int((time() - 14 * 24 * 60 * 60 + 60) * 1000 - discord.utils.DISCORD_EPOCH) << 22
+        channel_messages: Dict[int, List[discord.Object]] = defaultdict(list)
+        for job in delete_jobs:
+            channel_messages[job.channel_id].append(discord.Object(job.message_id))
+
+        for channel_id, messages in channel_messages.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            bulk_messages = [m for m in messages if m.id >= bulk_min_id]
+            calls = [bulk_messages[i:i + 100] for i in range(0, len(bulk_messages), 100)]
+            calls += [[m] for m in messages if m.id < bulk_min_id]
+            for call_messages in calls:
+                try:
+                    await channel.delete_messages(call_messages)
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException:
+                    logging.exception(f"Failed to delete {len(call_messages)} messages in channel {channel_id}.")
+            logging.info(f"Deleted {len(messages)} messages in channel {channel_id} using {len(calls)} API calls.")
 
     async def update_message(self, arg):
         if type(arg) is models.Entry:
             entry = arg
             message_id = entry.message_id
         elif type(arg) is int:
-            entry = await self.db.get_entry(arg)
+            entry = self.store.get(arg)
             message_id = arg
         else:
             raise Exception(
                 f"Unknown argument type to update_message: {type(arg)}. Value: {arg}")
-        is_cancelling = (
-            message_id in self.cancel_tasks
-            and self.cancel_tasks[message_id] is not None
-            and not self.cancel_tasks[message_id].done()
-        )
+        entry_state = self.entries.get(message_id)
+        if entry_state is None:
+            return
         try:
-            message = self.cached_messages[message_id]
-            cancel_delay = await self.db.get_setting(entry.server_id, models.SettingsType.CANCEL_DELAY)
-            await message.edit(embed=utils.create_embed(entry, cancel_delay, is_cancelling))
+            message = self.get_partial_message(message_id)
+            if message is None:
+                if await self.is_channel_deleted(entry.channel_id, entry.server_id):
+                    logging.warning(f"The channel of message {message_id} has been deleted. Deleting message from database.")
+                    await self.archive_deleted_entry(message_id)
+                else:
+                    logging.warning(f"The channel of message {message_id} is not available. Skipping update.")
+                return
+            settings = await self.db.get_settings(entry.server_id)
+            embed = utils.create_embed(entry, settings.cancel_delay, entry_state.is_cancelling(), settings.client_timestamps)
+            fingerprint = utils.get_embed_fingerprint(embed)
+            if entry_state.embed_fingerprint == fingerprint:
+                self.num_edits_skipped += 1
+                return
+            await message.edit(embed=embed)
+            entry_state.embed_fingerprint = fingerprint
+            self.num_edits_sent += 1
         except discord.NotFound:
             logging.warning(f"Attempted to update a message (ID: {entry.message_id}) that has already been deleted. Deleting message from database.")
-            await self.db.delete_entry(entry.message_id)
+            await self.archive_deleted_entry(entry.message_id)
+
+    async def update_message_limited(self, entry: models.Entry):
+        async with self.edit_limiter.acquire(entry.channel_id):
+            await self.update_message(entry)
+
+    async def schedule_refresh(self, entry: models.Entry):
+        '''Schedules the next refresh of the message for when its "Time left"
+        changes, staggered per message so that refreshes are spread out.
+        Messages with client rendered timestamps are never refreshed.'''
+        settings = await self.db.get_settings(entry.server_id)
+        if settings.client_timestamps:
+            self.refresh_scheduler.unschedule(entry.message_id)
+            return
+        time_left = entry.start_date - datetime.now(tz=timezone.utc)
+        delay = utils.get_next_refresh_delay(time_left, utils.get_refresh_stagger(entry.message_id))
+        if delay is None:
+            self.refresh_scheduler.unschedule(entry.message_id)
+        else:
+            self.refresh_scheduler.schedule(entry.message_id, time() + delay)
+
+    def request_update(self, message_id: int):
+        '''Schedules an edit of the message after the edit delay. Requests
+        made before the edit is sent are coalesced into it, so the message
+        shows the latest state at most one edit delay after the first request.'''
+        if message_id not in self.edit_scheduler:
+            self.edit_scheduler.schedule(message_id, time() + utils.get_edit_delay())
+
+    async def refresh_entry(self, message_id: int):
+        entry = self.store.get(message_id)
+        if entry is None:
+            return
+        await self.update_message_limited(entry)
+        if message_id in self.entries:
+            await self.schedule_refresh(entry)
+
+    def send_refreshes(self, due: List[Tuple[int, float]]):
+        for message_id, _ in due:
+            self.entries.send(message_id, state.EntryEvent(state.EntryEventKind.REFRESH))
+        logging.debug(f"Refreshing {len(due)} entries. Edits since startup: {self.num_edits_sent} sent, {self.num_edits_skipped} skipped (unchanged). {len(self.refresh_scheduler)} refreshes scheduled, {self.entries.num_live()} active entries, longest event queue: {self.entries.max_queue_depth()}.")
 
     async def update_timer(self):
         while True:
-            try:
-                entries = await self.db.get_all_entries()
-                tic = perf_counter()
-                for entry in entries:
-                    await self.update_message(entry)
-                if len(entries) > 0:
-                    toc = perf_counter()
-                    logging.info(f"Updated {len(entries)} entries took {toc-tic} seconds.")
-            except Exception:
-                traceback.print_exc()
-            await asyncio.sleep(utils.get_update_interval())
+            due = await self.refresh_scheduler.wait_due()
+            self.send_refreshes(due)
+
+    async def edit_timer(self):
+        while True:
+            due = await self.edit_scheduler.wait_due()
+            self.send_refreshes(due)
 
     async def finish_timer(self):
         while True:
-            entries = await self.db.get_all_entries()
-            for entry in entries:
-                timezone = entry.start_date.tzinfo
-                if entry.start_date > datetime.now(tz=timezone):
-                    continue
-                logging.info(f"Teamo message {entry.message_id} is finished. Creating end message.")
-                settings = await self.db.get_settings(entry.server_id)
-                channel_id = entry.channel_id if settings.end_channel == None else settings.end_channel
-                channel = self.bot.get_channel(channel_id)
-                embed = teamcreation.create_finish_embed(entry)
-                if settings.delete_end_delay < 0:
-                    end_message = await channel.send(embed=embed)
-                else:
-                    end_message = await channel.send(embed=embed, delete_after=settings.delete_end_delay)
-                logging.info(f"End message {end_message.id} created in channel {channel_id} ({channel.name}). It will be removed in {settings.delete_end_delay} seconds.")
-                await self.delete_entry(entry.message_id)
-            await asyncio.sleep(utils.get_check_interval())
+            due = await self.finish_scheduler.wait_due()
+            for message_id, deadline in due:
+                self.entries.send(message_id, state.EntryEvent(state.EntryEventKind.FINISH, deadline=deadline))
+
+    async def handle_entry_events(self, entry_state: state.EntryState, events: List[state.EntryEvent]):
+        '''Runs a batch of events of an entry. Called by the actor of the entry,
+        so events of the same entry never run concurrently.'''
+        message_id = entry_state.handle.message_id
+        # Events are run in the order they arrived. The entry ends at the
+        # first FINISH or CANCEL, and the events after it are dropped.
+        refresh = False
+        for event in events:
+            if event.kind == state.EntryEventKind.FINISH:
+                await self.finish_entry(message_id, event.deadline)
+                return
+            elif event.kind == state.EntryEventKind.CANCEL:
+                # The cancellation may have been aborted after its job fired
+                if entry_state.is_pending_cancel(event.job_id):
+                    await self.delete_entry(message_id, "cancelled")
+                    return
+            elif event.kind == state.EntryEventKind.REACTION_ADD:
+                await self.handle_reaction_add(entry_state, event.user_id, event.emoji)
+            elif event.kind == state.EntryEventKind.REACTION_REMOVE:
+                await self.handle_reaction_remove(entry_state, event.user_id, event.emoji)
+            elif event.kind == state.EntryEventKind.REFRESH:
+                refresh = True
+            if message_id not in self.entries:
+                return
+        if refresh:
+            await self.refresh_entry(message_id)
 
-    async def sync_message(self, message_id: int):
-        old_message = self.cached_messages[message_id]
-        channel = old_message.channel
-        self.cached_messages[message_id] = await channel.fetch_message(message_id)
+    async def handle_reaction_add(self, entry_state: state.EntryState, user_id: int, emoji: str):
+        message_id = entry_state.handle.message_id
+        # If cancel emoji: Start cancel procedure
+        if emoji == utils.cancel_emoji:
+            if entry_state.is_cancelling():
+                return
+            entry = self.store.get(message_id)
+            await self.start_cancel(entry_state, entry)
+            self.request_update(message_id)
+            return
+
+        # If number emoji: Add or edit member, remove old reactions, update message
+        num_players = utils.number_emojis.index(emoji) + 1
+        entry_state.reactions.add(user_id, emoji)
+        await self.store.edit_or_insert_member(message_id, models.Member(user_id, num_players))
+
+        # Update message
+        self.request_update(message_id)
+
+        # Delete the user's reactions to other numbers
+        message = self.get_partial_message(message_id)
+        for old_emoji in entry_state.reactions.get_other_emojis(user_id, emoji):
+            await message.remove_reaction(old_emoji, discord.Object(user_id))
+            entry_state.reactions.remove(user_id, old_emoji)
+
+    async def handle_reaction_remove(self, entry_state: state.EntryState, user_id: int, emoji: str):
+        message_id = entry_state.handle.message_id
+        # If cancel emoji: Abort cancel procedure
+        if emoji == utils.cancel_emoji:
+            if await self.abort_cancel(entry_state):
+                self.request_update(message_id)
+            return
+
+        # If number emoji: Remove member, update message
+        entry_state.reactions.remove(user_id, emoji)
+        member = self.store.get_member(message_id, user_id)
+        num_players = utils.number_emojis.index(emoji) + 1
+        if member is None or member.num_players != num_players:
+            return
+        await self.store.delete_member(message_id, user_id)
+        self.request_update(message_id)
+
+    async def finish_entry(self, message_id: int, deadline: float):
+        entry = self.store.get(message_id)
+        if entry is None:
+            return
+        latency = time() - deadline
+        logging.info(f"Teamo message {entry.message_id} is finished ({latency:.3f} seconds after its start time). Creating end message.")
+        settings = await self.db.get_settings(entry.server_id)
+        channel_id = entry.channel_id if settings.end_channel == None else settings.end_channel
+        channel = self.bot.get_channel(channel_id)
+        embed = teamcreation.create_finish_embed(entry)
+        end_message = await channel.send(embed=embed)
+        await self.delete_later(end_message, settings.delete_end_delay)
+        logging.info(f"End message {end_message.id} created in channel {channel_id} ({channel.name}). It will be removed in {settings.delete_end_delay} seconds.")
+        await self.delete_entry(entry.message_id, "finished")
+
+    async def archive_timer(self):
+        while True:
+            retention_days = utils.get_archive_retention_days()
+            if retention_days >= 0:
+                try:
+                    older_than = datetime.now(tz=timezone.utc) - timedelta(days=retention_days)
+                    num_pruned = await self.db.prune_archive(older_than)
+                    if num_pruned > 0:
+                        logging.info(f"Pruned {num_pruned} entries archived more than {retention_days} days ago.")
+                except Exception:
+                    traceback.print_exc()
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                try:
+                    differences = await self.store.check_consistency()
+                    logging.debug(f"Entry store consistency check found {len(differences)} differences.")
+                except Exception:
+                    traceback.print_exc()
+            logging.info(f"{self.entries.num_live()} active entries ({self.entries.num_added} added and {self.entries.num_evicted} evicted since startup). Longest event queue: {self.entries.max_queue_depth()}.")
+            await asyncio.sleep(60 * 60)
 
     async def send_and_log(self, channel: discord.TextChannel, message: str):
         logging.info(f"Sent message to Discord: {message}")
         delete_after = await self.db.get_setting(channel.guild.id, models.SettingsType.DELETE_GENERAL_DELAY)
-        if delete_after < 0:
-            await channel.send(message)
-        else:
-            await channel.send(message, delete_after=delete_after)
+        sent_message = await channel.send(message)
+        await self.delete_later(sent_message, delete_after)
 
     async def remove_user_message(self, message: discord.Message):
         delay = await self.db.get_setting(message.guild.id, models.SettingsType.DELETE_USE_DELAY)
-        if delay < 0:
-            return
-        await message.delete(delay=delay)
+        await self.delete_later(message, delay)
 
     ############## Discord events ##############
     @commands.Cog.listener()
@@ -136,36 +375,165 @@ class Teamo(commands.Cog):
 
     @commands.Cog.listener()
     async def on_ready(self):
-        # Make sure all messages in database exists in a channel
-        entries = await self.db.get_all_entries()
-        deleted_ids = []
-        for entry in entries:
-            channel_id = entry.channel_id
-            message_id = entry.message_id
-            try:
-                channel: discord.TextChannel = self.bot.get_channel(channel_id)
-                self.cached_messages[message_id] = await channel.fetch_message(message_id)
-                self.locks[message_id] = asyncio.Lock()
-            except discord.NotFound:
-                logging.warning(
-                    f"Discord message for database entry with message id {entry.message_id} does not exist. Removing entry from database.")
-                deleted_ids.append(entry.message_id)
-
-        await self.db.delete_entries(deleted_ids)
+        start_time = time()
+        if not self.background_tasks_started:
+            entries = await self.store.load()
+        else:
+            # The store is kept up to date while Teamo runs, so it is only
+            # loaded on the first start. Loading it again would drop member
+            # writes that commit while the database is read.
+            entries = self.store.get_all()
+        # Entries that are already active after a reconnect stay interactive
+        # while they are verified again
+        self.pending_verification = {
+            entry.message_id: asyncio.Event()
+            for entry in entries
+            if entry.message_id not in self.entries
+        }
 
         # Create settings entries for servers that don't already have an entry
-        for guild in self.bot.guilds:
-            settings = await self.db.get_settings(guild.id)
-            if settings == None:
-                tzinfo = utils.get_tzname_from_region(guild.region)
-                await self.db.insert_settings(guild.id, models.Settings(timezone=tzinfo))
-
-        # Create tasks for updating messages and checking whether a message is finished
-        if utils.get_update_interval() > 0:
-            asyncio.create_task(self.update_timer())
-        asyncio.create_task(self.finish_timer())
+        inserted_ids = await self.db.insert_missing_settings({
+            guild.id: models.Settings(timezone=utils.get_tzname_from_region(guild.region))
+            for guild in self.bot.guilds
+        })
+        if len(inserted_ids) > 0:
+            logging.info(f"Created default settings for {len(inserted_ids)} servers.")
+
+        cancel_job_ids: Dict[int, int] = dict()
+        if not self.background_tasks_started:
+            self.background_tasks_started = True
+            # Create tasks for updating messages and checking whether a message is finished
+            if utils.get_update_interval() > 0:
+                self.start_background_task(self.update_timer())
+            self.start_background_task(self.edit_timer())
+            self.start_background_task(self.finish_timer())
+            self.start_background_task(self.archive_timer())
+
+            # Restore the cancellations and message deletions from before a restart
+            restored_jobs = await self.jobs.restore()
+            cancel_job_ids = {
+                job.message_id: job.job_id
+                for job in restored_jobs
+                if job.kind == models.JobKind.CANCEL_ENTRY
+            }
+            self.start_background_task(self.jobs.run())
         self.startup_done.set()
-        logging.info("Teamo is ready!")
+
+        # Make sure all messages in database exists in a channel. Entries
+        # become interactive one by one as their messages are found.
+        await self.verify_entries(entries, cancel_job_ids)
+        self.pending_verification = dict()
+        logging.info(f"Teamo is ready! Verified {len(entries)} entries in {time() - start_time:.1f} seconds.")
+
+    async def verify_entries(self, entries: List[models.Entry], cancel_job_ids: Dict[int, int]):
+        channel_entries: Dict[int, List[models.Entry]] = defaultdict(list)
+        for entry in entries:
+            channel_entries[entry.channel_id].append(entry)
+
+        # Entries in deleted channels are removed without looking up their
+        # messages. Entries in channels that aren't available right now are
+        # kept for the next startup.
+        missing_channel_ids = [
+            channel_id for channel_id in channel_entries
+            if self.bot.get_channel(channel_id) is None
+        ]
+        deleted_channel_ids = []
+        deleted_ids = []
+        for channel_id in missing_channel_ids:
+            missing_entries = channel_entries.pop(channel_id)
+            if await self.is_channel_deleted(channel_id, missing_entries[0].server_id):
+                deleted_channel_ids.append(channel_id)
+                deleted_ids += [entry.message_id for entry in missing_entries]
+            for entry in missing_entries:
+                self.set_verified(entry.message_id)
+        if len(deleted_channel_ids) > 0:
+            logging.warning(f"{len(deleted_channel_ids)} channels with {len(deleted_ids)} Teamo entries no longer exist. Removing the entries from database.")
+        if len(missing_channel_ids) > len(deleted_channel_ids):
+            logging.warning(f"{len(missing_channel_ids) - len(deleted_channel_ids)} channels with Teamo entries are not available. Keeping the entries until the next startup.")
+
+        # Reads are rate limited per channel like edits, so the lookups are
+        # bounded per channel, and channels are looked up concurrently
+        limiter = concurrency.KeyedLimiter(per_key=2, total=10)
+        remaining_entries = [entry for entry_list in channel_entries.values() for entry in entry_list]
+        found = await asyncio.gather(*[
+            self.verify_entry(entry, limiter, cancel_job_ids.get(entry.message_id))
+            for entry in remaining_entries
+        ])
+        deleted_ids += [entry.message_id for entry, is_found in zip(remaining_entries, found) if is_found is False]
+        for message_id in deleted_ids:
+            self.evict_entry(message_id)
+        await self.store.archive_many(deleted_ids, "deleted")
+
+    async def verify_entry(self, entry: models.Entry, limiter: concurrency.KeyedLimiter, cancel_job_id: int = None) -> bool:
+        '''Looks up the Discord message of the entry and makes the entry
+        interactive if it exists.
+
+        Returns:
+            True if the message exists, False if it has been deleted and
+            None if it couldn't be looked up.
+        '''
+        message_id = entry.message_id
+        try:
+            channel: discord.TextChannel = self.bot.get_channel(entry.channel_id)
+            async with limiter.acquire(entry.channel_id):
+                message = await channel.fetch_message(message_id)
+        except discord.NotFound:
+            logging.warning(
+                f"Discord message for database entry with message id {message_id} does not exist. Removing entry from database.")
+            self.set_verified(message_id)
+            return False
+        except discord.HTTPException:
+            logging.exception(f"Failed to fetch Discord message for database entry with message id {message_id}.")
+            self.set_verified(message_id)
+            return None
+
+        # After a reconnect, entries that are already active keep their state
+        if message_id not in self.entries:
+            self.entries.add(state.EntryState(
+                handle=models.MessageHandle(message.channel.id, message.id),
+                reactions=models.ReactionState.from_members(entry.members, utils.number_emojis),
+                cancel_job_id=cancel_job_id
+            ))
+        self.set_verified(message_id)
+        self.finish_scheduler.schedule(message_id, entry.get_start_timestamp())
+        await self.schedule_refresh(entry)
+        return True
+
+    async def is_channel_deleted(self, channel_id: int, server_id: int) -> bool:
+        '''Checks whether a channel that isn't in the cache has been deleted.
+
+        The channels of available servers are always in the cache. Servers
+        can be unavailable during a Discord outage, and their channels are
+        only deleted if Discord says so.
+        '''
+        guild: discord.Guild = self.bot.get_guild(server_id)
+        if guild is not None and not guild.unavailable:
+            return True
+        try:
+            await self.bot.fetch_channel(channel_id)
+        except discord.NotFound:
+            return True
+        except discord.HTTPException:
+            logging.exception(f"Failed to fetch channel {channel_id}.")
+        return False
+
+    def set_verified(self, message_id: int):
+        event = self.pending_verification.get(message_id)
+        if event is not None:
+            event.set()
+
+    def may_be_entry(self, message_id: int) -> bool:
+        '''Checks whether the message may be a Teamo message, without any I/O.
+        Before the entries have been loaded on startup, any message may be.'''
+        return not self.startup_done.is_set() or message_id in self.store
+
+    async def wait_until_verified(self, message_id: int) -> bool:
+        '''Waits until the Discord message of the entry has been looked up
+        during startup. Returns False if the message isn't available.'''
+        event = self.pending_verification.get(message_id)
+        if event is not None:
+            await event.wait()
+        return message_id in self.entries
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
@@ -177,55 +545,27 @@ class Teamo(commands.Cog):
         if emoji.name not in utils.number_emojis and emoji.name != utils.cancel_emoji:
             return
 
-        # Make sure the message reacted to is a Teamo message (exists in db)
+        # Make sure the message reacted to is a Teamo message
         message_id = payload.message_id
-        db_entry = await self.db.get_entry(message_id)
-        if (db_entry is None):
+        if not self.may_be_entry(message_id):
             return
 
         await self.startup_done.wait()
-        # If cancel emoji: Start cancel procedure
-        if str(emoji) == utils.cancel_emoji:
-            logging.info(f"Received cancel emoji on {message_id}")
-            cancel_task = asyncio.create_task(self.cancel_after(message_id))
-            self.cancel_tasks[message_id] = cancel_task
-            await self.update_message(message_id)
-            await self.sync_message(message_id)
+        if not await self.wait_until_verified(message_id):
             return
 
-        # If number emoji: Add or edit member, remove old reactions, update message
-        async with self.locks[message_id]:
+        if str(emoji) == utils.cancel_emoji:
+            logging.info(f"Received cancel emoji on {message_id}")
+        else:
             logging.info(f"Received number emoji {str(emoji)}  on {message_id} from user {payload.member.id} ({payload.member.display_name})")
-            num_players = utils.number_emojis.index(emoji.name) + 1
-            member = models.Member(
-                payload.member.id, num_players)
-            previous_num_players = await self.db.edit_or_insert_member(message_id, member)
-
-            # Do not have to remove any reactions if the user wasn't registered before
-            # or if the previous entry was the same as the current one (somehow)
-            if previous_num_players is None or previous_num_players == num_players:
-                await self.sync_message(message_id)
-                await self.update_message(message_id)
-                return
-
-            # Update message
-            await self.update_message(message_id)
-
-            # Delete old reactions
-            message = self.cached_messages[message_id]
-            previous_emoji = utils.number_emojis[previous_num_players-1]
-            old_reaction = next(
-                (r for r in message.reactions if r.emoji == previous_emoji),
-                None
-            )
-            await old_reaction.remove(payload.member)
-            await self.sync_message(message_id)
+        self.entries.send(message_id, state.EntryEvent(state.EntryEventKind.REACTION_ADD, payload.member.id, emoji.name))
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
-        await self.startup_done.wait()
+        # Make sure the message reacted to is a Teamo message
         message_id = payload.message_id
-        await self.sync_message(message_id)
+        if not self.may_be_entry(message_id):
+            return
 
         if payload.user_id == self.bot.user.id:
             return
@@ -235,40 +575,38 @@ class Teamo(commands.Cog):
         if emoji.name not in utils.number_emojis and emoji.name != utils.cancel_emoji:
             return
 
-        # Make sure the message reacted to is a Teamo message (exists in db)
-        db_entry = await self.db.get_entry(message_id)
-        if (db_entry is None):
+        await self.startup_done.wait()
+        if not await self.wait_until_verified(message_id):
             return
 
-        # If cancel emoji: Abort cancel procedure
         if str(emoji) == utils.cancel_emoji:
             logging.info(f"Cancel emoji removed on message {message_id}")
-            cancel_task = self.cancel_tasks[message_id]
-            if cancel_task is None or cancel_task.done():
-                return
-            cancel_task.cancel()
-            self.cancel_tasks[message_id] = None
-            await self.update_message(db_entry)
-
-        # If number emoji: Remove member, update message
-        async with self.locks[message_id]:
-            user_id = payload.user_id
-            logging.info(f"Number emoji {str(emoji)}  removed on message {message_id} by user {user_id}")
-            db_member = await self.db.get_member(message_id, user_id)
-            num_players = utils.number_emojis.index(str(emoji)) + 1
-            if db_member.num_players != num_players:
-                return
-            await self.db.delete_member(message_id, user_id)
-            await self.update_message(message_id)
-            await self.sync_message(message_id)
+        else:
+            logging.info(f"Number emoji {str(emoji)}  removed on message {message_id} by user {payload.user_id}")
+        self.entries.send(message_id, state.EntryEvent(state.EntryEventKind.REACTION_REMOVE, payload.user_id, emoji.name))
 
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         message_id = payload.message_id
-        entry_exists = await self.db.exists_entry(message_id)
-        if entry_exists:
-            logging.info(f"Teamo message {message_id} was deleted by a user. Removing database entry.")
-            await self.db.delete_entry(message_id)
+        if not self.may_be_entry(message_id):
+            return
+        await self.startup_done.wait()
+        if message_id in self.store:
+            logging.info(f"Teamo message {message_id} was deleted by a user. Archiving database entry.")
+            await self.archive_deleted_entry(message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if self.startup_done.is_set() and not any(message_id in self.store for message_id in payload.message_ids):
+            return
+        await self.startup_done.wait()
+        message_ids = [message_id for message_id in payload.message_ids if message_id in self.store]
+        if len(message_ids) == 0:
+            return
+        logging.info(f"{len(message_ids)} Teamo messages were bulk deleted by a user. Archiving database entries.")
+        for message_id in message_ids:
+            self.evict_entry(message_id)
+        await self.store.archive_many(message_ids, "deleted")
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx: commands.Context, error: commands.CommandError):
@@ -290,7 +628,7 @@ class Teamo(commands.Cog):
         settings = await self.db.get_settings(guild.id)
         if settings == None:
             tzinfo = utils.get_tzname_from_region(guild.region)
-            await self.db.insert_settings(guild.id, timezone=tzinfo)
+            await self.db.insert_settings(guild.id, models.Settings(timezone=tzinfo))
         logging.info(f"Joined guild {guild.id} ({guild.name})")
 
     ############## Teamo commands ##############
@@ -369,16 +707,17 @@ class Teamo(commands.Cog):
             start_date=date,
             max_players=max_players
         )
-        embed = utils.create_embed(entry)
+        embed = utils.create_embed(entry, client_timestamps=settings.client_timestamps)
         teamo_post_channel = ctx.channel if settings.waiting_channel == None else self.bot.get_channel(settings.waiting_channel)
         message: discord.Message = await teamo_post_channel.send(embed=embed)
-        self.cached_messages[message.id] = message
+        entry_state = self.entries.add(state.EntryState(models.MessageHandle(teamo_post_channel.id, message.id)))
 
         # Create database and runtime entries
         entry.message_id = message.id
         entry.channel_id = teamo_post_channel.id
         entry.server_id = ctx.guild.id
-        await self.db.insert_entry(entry)
+        await self.store.insert(entry)
+        self.finish_scheduler.schedule(entry.message_id, entry.get_start_timestamp())
 
         # If the message was received in a different channel from where the
         # Teamo message will be posted, create a message to point the user
@@ -388,20 +727,15 @@ class Teamo(commands.Cog):
 
         # Update message again to show ID
         # Add reactions
-        await self.update_message(entry)
-        self.locks[message.id] = asyncio.Lock()
-        async with self.locks[message.id]:
-            for i in range(min(max_players-1, 10)):
-                await message.add_reaction(utils.number_emojis[i])
-
-            await message.add_reaction(utils.cancel_emoji)
+        entry_state.send(state.EntryEvent(state.EntryEventKind.REFRESH))
+        for i in range(min(max_players-1, 10)):
+            await message.add_reaction(utils.number_emojis[i])
 
-        self.cached_messages[message.id] = await teamo_post_channel.fetch_message(message.id)
+        await message.add_reaction(utils.cancel_emoji)
 
         # Remove initial message
         delete_delay = await self.db.get_setting(ctx.guild.id, models.SettingsType.DELETE_GENERAL_DELAY)
-        if delete_delay >= 0:
-            await ctx.message.delete(delay=delete_delay)
+        await self.delete_later(ctx.message, delete_delay)
         logging.info(f"Teamo message {message.id} created in channel {teamo_post_channel.id} ({teamo_post_channel.name}) by {ctx.author.id} ({ctx.author.name}).")
 
     ############## Server settings commands ##############
@@ -462,6 +796,7 @@ class Teamo(commands.Cog):
             settings set delete_use_delay 40
             settings set use_channel 749638923554390096
             settings set end_channel a-channel-name
+            settings set client_timestamps true
         '''
         if not ctx.author.guild_permissions.administrator:
             await self.send_and_log(ctx.channel, "Only members with the Administrator permission can set Teamo server settings.")
@@ -479,6 +814,16 @@ class Teamo(commands.Cog):
                 await self.send_and_log(ctx.channel, f"Invalid time zone: \"{value}\". See https://en.wikipedia.org/wiki/List_of_tz_database_time_zones for a list of valid time zone values.")
                 return
 
+        # Boolean settings are stored as 0 or 1
+        if setting.is_bool():
+            if value.lower() in ("1", "true", "yes", "on"):
+                value = "1"
+            elif value.lower() in ("0", "false", "no", "off"):
+                value = "0"
+            else:
+                await self.send_and_log(ctx.channel, f"Invalid value for `{key}`: \"{value}\". Use `true` or `false`.")
+                return
+
         # Make sure the channel exists
         if setting.is_channel_id():
             channel_found = False
@@ -498,6 +843,14 @@ class Teamo(commands.Cog):
 
 
         await self.db.edit_setting(ctx.guild.id, setting, value)
+
+        # Re-render the server's Teamo messages, and start or stop refreshing them
+        if setting in (models.SettingsType.CLIENT_TIMESTAMPS, models.SettingsType.TIMEZONE):
+            if setting == models.SettingsType.TIMEZONE:
+                settings = await self.db.get_settings(ctx.guild.id)
+                self.store.set_server_timezone(ctx.guild.id, settings.get_tzinfo())
+            for entry in self.store.get_server_entries(ctx.guild.id):
+                self.entries.send(entry.message_id, state.EntryEvent(state.EntryEventKind.REFRESH))
         await self.send_and_log(ctx.channel, f"Successfully set `{key}` to `{value}`!")
 
     ############## Other commands ##############
@@ -544,6 +897,14 @@ class Teamo(commands.Cog):
 
 
 
+class TeamoBot(commands.Bot):
+    async def close(self):
+        await super().close()
+        teamo = self.get_cog("Teamo")
+        if teamo is not None:
+            await teamo.close()
+
+
 def main():
     dotenv_filename = pkg_resources.resource_filename('teamo', 'resources/.env')
     load_dotenv(dotenv_filename)
@@ -557,10 +918,17 @@ def main():
         default="db/teamo.db",
         help="specify the location of the database to use (default: db/teamo.db)"
     )
+    parser.add_argument(
+        "--storage-profile",
+        dest="storage_profile",
+        choices=database.STORAGE_PROFILES.keys(),
+        default="default",
+        help="SQLite journaling and caching settings. \"wal\" enables write-ahead logging with periodic checkpoints (default: default)"
+    )
     args = parser.parse_args()
 
-    bot = commands.Bot(command_prefix=commands.when_mentioned)
-    bot.add_cog(Teamo(bot, args.database))
+    bot = TeamoBot(command_prefix=commands.when_mentioned)
+    bot.add_cog(Teamo(bot, args.database, database.STORAGE_PROFILES[args.storage_profile]))
 
     @bot.event
     async def on_ready():
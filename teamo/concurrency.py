@@ -0,0 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable
+
+
+class KeyedLimiter:
+    ''' Bounds the number of concurrently running operations, both per key
+    (e.g. per Discord channel) and in total.
+
+    Usage:
+        async with limiter.acquire(channel_id):
+            await message.edit(...)
+    '''
+
+    def __init__(self, per_key: int, total: int):
+        self.per_key: int = per_key
+        self.total: int = total
+        self._total_semaphore = asyncio.Semaphore(total)
+        self._key_semaphores: Dict[Hashable, asyncio.Semaphore] = dict()
+        self._key_users: Dict[Hashable, int] = dict()
+
+    def num_keys(self) -> int:
+        return len(self._key_semaphores)
+
+    @asynccontextmanager
+    async def acquire(self, key: Hashable):
+        if key not in self._key_semaphores:
+            self._key_semaphores[key] = asyncio.Semaphore(self.per_key)
+            self._key_users[key] = 0
+        self._key_users[key] += 1
+        try:
+            # Wait for the key before taking one of the shared slots, so that
+            # operations waiting for a busy key don't block other keys
+            async with self._key_semaphores[key]:
+                async with self._total_semaphore:
+                    yield
+        finally:
+            self._key_users[key] -= 1
+            if self._key_users[key] == 0:
+                del self._key_users[key]
+                del self._key_semaphores[key]
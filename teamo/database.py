@@ -1,89 +1,352 @@
-from dataclasses import astuple
+import asyncio
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from dataclasses import astuple, dataclass, fields, replace
+from functools import lru_cache, partial
 import logging
 import sys
-from typing import List
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List
 from sqlite3 import PARSE_DECLTYPES
 
 import aiosqlite
 from dateutil import tz
 
-from teamo import models
+from teamo import migrations, models
+
+
+# The settings table columns, in the order of the fields of models.Settings
+SETTINGS_COLUMNS = ", ".join(f.name for f in fields(models.Settings))
+
+
+@lru_cache(maxsize=None)
+def get_tzinfo(timezone: str):
+    ''' Cached time zone lookup for the timezone column of the settings table.
+
+    Entries belonging to a server without settings use the default time zone.
+    '''
+    if timezone is None:
+        return models.Settings().get_tzinfo()
+    return models.Settings(timezone=timezone).get_tzinfo()
+
+@dataclass
+class PoolStats:
+    ''' Wait time statistics for a ConnectionPool.
+
+    Attributes:
+        acquisitions (int) Number of times a connection has been handed out.
+        total_wait (float) Total number of seconds callers have waited for a connection.
+        max_wait (float) The longest time (in seconds) a single caller has waited for a connection.
+    '''
+    acquisitions: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def mean_wait(self) -> float:
+        if self.acquisitions == 0:
+            return 0.0
+        return self.total_wait / self.acquisitions
+
+
+@dataclass
+class StorageProfile:
+    ''' SQLite tuning applied to every database connection
+
+    Attributes:
+        journal_mode (str) Value of the journal_mode pragma, e.g. "DELETE" or "WAL".
+        synchronous (str) Value of the synchronous pragma, e.g. "FULL" or "NORMAL".
+        cache_size (int) Value of the cache_size pragma. Negative values are in KiB. None -> SQLite default.
+        mmap_size (int) Number of bytes of the database file to memory map. None -> SQLite default.
+        temp_store (str) Value of the temp_store pragma, e.g. "MEMORY". None -> SQLite default.
+        checkpoint_interval (float) Number of seconds between passive WAL checkpoints. <= 0 -> No periodic checkpoints.
+    '''
+    journal_mode: str = "DELETE"
+    synchronous: str = "FULL"
+    cache_size: int = None
+    mmap_size: int = None
+    temp_store: str = None
+    checkpoint_interval: float = 0
+
+    def get_pragmas(self) -> List[str]:
+        pragmas = [
+            f"PRAGMA journal_mode = {self.journal_mode}",
+            f"PRAGMA synchronous = {self.synchronous}",
+        ]
+        if self.cache_size is not None:
+            pragmas.append(f"PRAGMA cache_size = {self.cache_size}")
+        if self.mmap_size is not None:
+            pragmas.append(f"PRAGMA mmap_size = {self.mmap_size}")
+        if self.temp_store is not None:
+            pragmas.append(f"PRAGMA temp_store = {self.temp_store}")
+        return pragmas
+
+
+STORAGE_PROFILES = {
+    # SQLite's defaults: rollback journal and a sync on every commit
+    "default": StorageProfile(),
+    # Readers don't block behind writers, and commits only sync at checkpoints
+    "wal": StorageProfile(
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        cache_size=-16 * 1024,
+        mmap_size=64 * 1024 * 1024,
+        temp_store="MEMORY",
+        checkpoint_interval=5 * 60
+    ),
+}
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class ConnectionPool:
+    ''' A fixed size pool of long-lived aiosqlite connections.
+
+    The connections are opened by open() and stay open until close() is
+    called. Use acquire() to borrow a connection. The statements in pragmas
+    are run on every connection when it is opened.
+    '''
+
+    # Waiting longer than this (in seconds) for a connection is logged as a warning
+    slow_wait_threshold = 1.0
+
+    def __init__(self, db_name: str, size: int = 4, pragmas: List[str] = None):
+        self.db_name: str = db_name
+        self.size: int = size
+        self.pragmas: List[str] = pragmas if pragmas is not None else []
+        self.stats = PoolStats()
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue = None
+
+    def is_open(self) -> bool:
+        return self._idle is not None
+
+    async def open(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            db = await aiosqlite.connect(self.db_name, detect_types=PARSE_DECLTYPES)
+            for pragma in self.pragmas:
+                await db.execute(pragma)
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+
+    async def close(self):
+        if not self.is_open():
+            return
+        for db in self._connections:
+            await db.close()
+        self._connections = []
+        self._idle = None
+        logging.info(
+            f"Closed database connection pool. {self.stats.acquisitions} acquisitions, "
+            f"mean wait {self.stats.mean_wait() * 1000:.3f} ms, max wait {self.stats.max_wait * 1000:.3f} ms.")
+
+    @asynccontextmanager
+    async def acquire(self):
+        if not self.is_open():
+            raise Exception(f"Connection pool for database {self.db_name} is not open.")
+
+        tic = perf_counter()
+        db = await self._idle.get()
+        wait = perf_counter() - tic
+        self.stats.acquisitions += 1
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        if wait > self.slow_wait_threshold:
+            logging.warning(f"Waited {wait:.3f} seconds for a database connection.")
+
+        try:
+            yield db
+        except BaseException:
+            # Never hand out a connection with a half-finished transaction
+            await db.rollback()
+            raise
+        finally:
+            self._idle.put_nowait(db)
+
+
+class WriteQueue:
+    ''' Runs database writes from a single task, grouping the writes that
+    arrive within batch_window seconds into one transaction.
+
+    A write is a coroutine function taking the connection as its only
+    argument. It must not commit. Writes run in the order they were
+    submitted, each inside its own savepoint, so a failing write is rolled
+    back without affecting the rest of its batch.
+    '''
+
+    def __init__(self, pool: ConnectionPool, batch_window: float = 0.005, max_batch_size: int = 1000):
+        self.pool: ConnectionPool = pool
+        self.batch_window: float = batch_window
+        self.max_batch_size: int = max_batch_size
+        self.num_batches: int = 0
+        self.num_writes: int = 0
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        ''' Waits for all submitted writes to be committed and stops the queue '''
+        if not self.is_running():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        if self.num_batches > 0:
+            logging.info(f"Stopped database write queue. {self.num_writes} writes in {self.num_batches} transactions ({self.num_writes / self.num_batches:.1f} writes per transaction).")
+
+    async def submit(self, write: Callable[[aiosqlite.Connection], Awaitable]):
+        ''' Queues a write and returns its result once it has been committed '''
+        if not self.is_running():
+            raise Exception("The database write queue is not running.")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((write, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            while not self._queue.empty() and len(batch) < self.max_batch_size:
+                batch.append(self._queue.get_nowait())
+
+            # None is put on the queue by stop()
+            stopping = None in batch
+            batch = [item for item in batch if item is not None]
+            if len(batch) > 0:
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch):
+        results = []
+        try:
+            async with self.pool.acquire() as db:
+                # Take the write lock up front. A deferred transaction that
+                # starts with a read fails at once with "database is locked"
+                # if another connection commits before its first write,
+                # instead of waiting for the busy timeout.
+                await db.execute("BEGIN IMMEDIATE")
+                for write, future in batch:
+                    await db.execute("SAVEPOINT write")
+                    try:
+                        results.append((future, await write(db), None))
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO write")
+                        results.append((future, None, e))
+                    await db.execute("RELEASE write")
+                await db.commit()
+        except Exception as e:
+            logging.exception(f"Failed to commit a batch of {len(batch)} database writes.")
+            results = [(future, None, e) for _, future in batch]
+
+        self.num_batches += 1
+        self.num_writes += len(batch)
+        for future, result, exception in results:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
 
 class Database:
-    def __init__(self, db_name: str):
+    def __init__(
+            self,
+            db_name: str,
+            pool_size: int = 4,
+            storage_profile: StorageProfile = STORAGE_PROFILES["default"],
+            write_batch_window: float = 0.005):
         self.db_name: str = db_name
+        self.storage_profile: StorageProfile = storage_profile
+        self.pool = ConnectionPool(
+            db_name,
+            pool_size,
+            ["PRAGMA foreign_keys = ON"] + storage_profile.get_pragmas()
+        )
+        self.write_queue = WriteQueue(self.pool, write_batch_window)
+        self._checkpoint_task: asyncio.Task = None
+        self.settings_cache: Dict[int, models.Settings] = dict()
+        self.settings_cache_stats = CacheStats()
 
     async def init(self):
-        async with aiosqlite.connect(self.db_name, detect_types=PARSE_DECLTYPES) as db:
+        # on_connect (and therefore init) runs again on every reconnect
+        if not self.pool.is_open():
             logging.info(f"Using database file {self.db_name}")
-            await db.execute('''CREATE TABLE IF NOT EXISTS entries (
-                entry_id integer primary key,
-                channel_id integer,
-                server_id integer,
-                game text,
-                start_date timestamp,
-                max_players integer
-                )''')
-
-            await db.execute('''CREATE TABLE IF NOT EXISTS members (
-                entry_id integer,
-                member_id integer,
-                num_players integer,
-                primary key (member_id, entry_id)
-                foreign key (entry_id) references entries (entry_id)
-                )''')
-
-            await db.execute('''CREATE TABLE IF NOT EXISTS settings (
-                guild_id integer primary key,
-                use_channel integer,
-                waiting_channel integer,
-                end_channel integer,
-                delete_general_delay integer,
-                delete_use_delay integer,
-                delete_end_delay integer,
-                cancel_delay integer,
-                timezone text
-                )''')
+            async with aiosqlite.connect(self.db_name, detect_types=PARSE_DECLTYPES) as db:
+                await migrations.migrate(db)
+            await self.pool.open()
+            self.write_queue.start()
+            if self.storage_profile.checkpoint_interval > 0:
+                self._checkpoint_task = asyncio.create_task(self.checkpoint_timer())
+
+        async with self.pool.acquire() as db:
+            await self.load_all_settings(db=db)
+            logging.info(f"Loaded settings for {len(self.settings_cache)} guilds.")
+
+    async def close(self):
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+            self._checkpoint_task = None
+        await self.write_queue.stop()
+        await self.pool.close()
+
+    async def checkpoint_timer(self):
+        while True:
+            await asyncio.sleep(self.storage_profile.checkpoint_interval)
+            try:
+                async with self.pool.acquire() as db:
+                    cursor = await db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                    busy, log_pages, checkpointed_pages = await cursor.fetchone()
+                logging.debug(f"WAL checkpoint: {checkpointed_pages} of {log_pages} pages checkpointed (busy: {busy}).")
+            except Exception:
+                logging.exception("WAL checkpoint failed.")
 
     def check_connected(func):
         async def wrapper(self, *args, db=None, **kwargs):
-            has_db = True
-            if db == None:
-                has_db = False
-                db = await aiosqlite.connect(self.db_name, detect_types=PARSE_DECLTYPES)
-            try:
+            if db is not None:
+                return await func(self, *args, db=db, **kwargs)
+            async with self.pool.acquire() as db:
                 return await func(self, *args, db=db, **kwargs)
-            finally:
-                if not has_db:
-                    await db.close()
 
         return wrapper
 
     ############## Entry methods ##############
     @check_connected
     async def get_entry(self, message_id: int, db=None) -> models.Entry:
-        # Get the time zone info
-        server_id = await self.get_entry_server_id(message_id, db=db)
-        settings = await self.get_settings(server_id, db=db)
-        tzinfo = settings.get_tzinfo()
-
-        # Get the entry from db and create the Entry object
-        entry_cursor = await db.execute(
-            "SELECT * FROM entries WHERE entry_id=?", (message_id,)
+        # Get the entry, its server's time zone and its members in one query.
+        # There is one row per member, or a single row with NULL members if
+        # no one has registered.
+        cursor = await db.execute(
+            '''
+                SELECT entries.*, settings.timezone, members.member_id, members.num_players
+                FROM entries
+                LEFT JOIN settings ON settings.guild_id = entries.server_id
+                LEFT JOIN members ON members.entry_id = entries.entry_id
+                WHERE entries.entry_id=?
+                ORDER BY members.rowid
+            ''',
+            (message_id,)
         )
-        entry_row = await entry_cursor.fetchone()
-        if entry_row is None:
+        rows = await cursor.fetchall()
+        if len(rows) == 0:
             return None
-        entry = models.Entry.create_with_tz(*entry_row, tzinfo=tzinfo)
 
-        # Add members
-        row_cursor = await db.execute(
-            "SELECT member_id, num_players FROM members WHERE entry_id=?", (message_id,)
-        )
-        member_rows = await row_cursor.fetchall()
-        for row in member_rows:
-            member = models.Member(*row)
-            entry.members.append(member)
+        entry = models.Entry.create_from_timestamp(*rows[0][:-3], tzinfo=get_tzinfo(rows[0][-3]))
+        for row in rows:
+            member_id, num_players = row[-2:]
+            if member_id is not None:
+                entry.members.append(models.Member(member_id, num_players))
 
         return entry
 
@@ -101,7 +364,14 @@ class Database:
     async def insert_entry(self, entry: models.Entry, db=None):
         await db.execute(
             "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
-            astuple(entry.with_naive_datetime())[:-1]
+            (
+                entry.message_id,
+                entry.channel_id,
+                entry.server_id,
+                entry.game,
+                entry.get_start_timestamp(),
+                entry.max_players
+            )
         )
 
         member_tuple_list = list(map(lambda m: (entry.message_id, m.user_id, m.num_players), entry.members))
@@ -113,11 +383,56 @@ class Database:
 
     @check_connected
     async def get_all_entries(self, db=None) -> List[models.Entry]:
-        entry_id_cursor = await db.execute("SELECT entry_id FROM entries")
-        entry_id_rows = await entry_id_cursor.fetchall()
+        return await self.load_entries(db=db)
+
+    @check_connected
+    async def get_entries(self, message_ids: List[int], db=None) -> List[models.Entry]:
+        '''Gets the entries with the given message IDs. Unknown IDs are ignored.'''
+        if len(message_ids) == 0:
+            return []
+        placeholders = ", ".join("?" * len(message_ids))
+        return await self.load_entries(f"entries.entry_id IN ({placeholders})", tuple(message_ids), db=db)
+
+    @check_connected
+    async def get_due_entries(self, now: datetime, db=None) -> List[models.Entry]:
+        '''Gets the entries whose start date is at or before now.'''
+        return await self.load_entries("entries.start_date <= ?", (int(now.timestamp()),), db=db)
+
+    @check_connected
+    async def load_entries(self, condition: str = "1", parameters: tuple = (), db=None) -> List[models.Entry]:
+        '''Loads the entries matching the SQL condition, their members and
+        their servers' time zones using two queries, regardless of the number
+        of entries.
+        '''
+
+        entry_cursor = await db.execute(
+            f'''
+                SELECT entries.*, settings.timezone
+                FROM entries
+                LEFT JOIN settings ON settings.guild_id = entries.server_id
+                WHERE {condition}
+                ORDER BY entries.entry_id
+            ''',
+            parameters
+        )
+        entry_rows = await entry_cursor.fetchall()
         entries = dict()
-        for row in entry_id_rows:
-            entries[row[0]] = await self.get_entry(row[0], db=db)
+        for row in entry_rows:
+            entries[row[0]] = models.Entry.create_from_timestamp(*row[:-1], tzinfo=get_tzinfo(row[-1]))
+
+        member_cursor = await db.execute(
+            f'''
+                SELECT entry_id, member_id, num_players FROM members
+                WHERE entry_id IN (SELECT entries.entry_id FROM entries WHERE {condition})
+                ORDER BY rowid
+            ''',
+            parameters
+        )
+        member_rows = await member_cursor.fetchall()
+        for entry_id, member_id, num_players in member_rows:
+            entry = entries.get(entry_id)
+            if entry is not None:
+                entry.members.append(models.Member(member_id, num_players))
 
         return list(entries.values())
 
@@ -132,12 +447,10 @@ class Database:
 
     @check_connected
     async def delete_entry(self, message_id: int, db=None):
+        # Members are deleted by the foreign key's ON DELETE CASCADE
         await db.execute(
             "DELETE FROM entries WHERE entry_id=?", (message_id,)
         )
-        await db.execute(
-            "DELETE FROM members WHERE entry_id=?", (message_id,)
-        )
         await db.commit()
 
     @check_connected
@@ -146,10 +459,88 @@ class Database:
         await db.executemany(
             "DELETE FROM entries WHERE entry_id=?", message_ids_tup
         )
+        await db.commit()
+
+    ############## Archive methods ##############
+    # Entries that are finished, cancelled or deleted are moved to the
+    # entry_archive and member_archive tables, which active entry queries never read.
+    async def archive_entry(self, message_id: int, reason: str):
+        await self.archive_entries([message_id], reason)
+
+    async def archive_entries(self, message_ids: List[int], reason: str):
+        '''Moves the entries and their members to the archive in one transaction.'''
+        await self.write_queue.submit(partial(self._archive_entries, message_ids, reason))
+
+    async def _archive_entries(self, message_ids: List[int], reason: str, db: aiosqlite.Connection):
+        archived_at = int(datetime.now(tz=timezone.utc).timestamp())
+        message_ids_tup = list(map(lambda id: (id,), message_ids))
+        await db.executemany(
+            "INSERT INTO entry_archive SELECT *, ?, ? FROM entries WHERE entry_id=?",
+            [(archived_at, reason, id) for id in message_ids]
+        )
         await db.executemany(
-            "DELETE FROM members WHERE entry_id=?", message_ids_tup
+            "INSERT INTO member_archive SELECT * FROM members WHERE entry_id=? ORDER BY rowid",
+            message_ids_tup
         )
-        await db.commit()
+        await db.executemany(
+            "DELETE FROM entries WHERE entry_id=?", message_ids_tup
+        )
+
+    @check_connected
+    async def get_archived_entry(self, message_id: int, db=None) -> models.Entry:
+        cursor = await db.execute(
+            '''
+                SELECT entry_id, channel_id, server_id, game, start_date, max_players, settings.timezone
+                FROM entry_archive
+                LEFT JOIN settings ON settings.guild_id = entry_archive.server_id
+                WHERE entry_id=?
+            ''',
+            (message_id,)
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        entry = models.Entry.create_from_timestamp(*row[:-1], tzinfo=get_tzinfo(row[-1]))
+
+        cursor = await db.execute(
+            "SELECT member_id, num_players FROM member_archive WHERE entry_id=? ORDER BY rowid",
+            (message_id,)
+        )
+        for member_row in await cursor.fetchall():
+            entry.members.append(models.Member(*member_row))
+        return entry
+
+    async def prune_archive(self, older_than: datetime, batch_size: int = 500) -> int:
+        '''Deletes entries archived before older_than, batch_size entries per
+        transaction, and returns the freed pages to the file system.
+
+        Returns the number of deleted entries.
+        '''
+        num_deleted = 0
+        while True:
+            batch_deleted = await self.write_queue.submit(
+                partial(self._prune_archive_batch, int(older_than.timestamp()), batch_size))
+            num_deleted += batch_deleted
+            if batch_deleted < batch_size:
+                break
+
+        if num_deleted > 0:
+            async with self.pool.acquire() as db:
+                cursor = await db.execute("PRAGMA incremental_vacuum")
+                await cursor.fetchall()
+        return num_deleted
+
+    async def _prune_archive_batch(self, older_than: int, batch_size: int, db: aiosqlite.Connection) -> int:
+        # Archived members are deleted by the foreign key's ON DELETE CASCADE
+        cursor = await db.execute(
+            '''
+                DELETE FROM entry_archive WHERE entry_id IN (
+                    SELECT entry_id FROM entry_archive WHERE archived_at < ? LIMIT ?
+                )
+            ''',
+            (older_than, batch_size)
+        )
+        return cursor.rowcount
 
     ############## Member methods ##############
     @check_connected
@@ -163,77 +554,128 @@ class Database:
             return None
         return models.Member(*row)
 
-    @check_connected
-    async def insert_member(self, entry_id: int, member: models.Member, db=None):
-        await db.execute(
-            "INSERT INTO members VALUES (?, ?, ?)",
-            (
-                entry_id,
-                member.user_id,
-                member.num_players
-            )
-        )
-        await db.commit()
+    # Member writes go through the write queue, which commits all writes
+    # submitted within a short window in one transaction.
+    async def insert_member(self, entry_id: int, member: models.Member):
+        await self.write_queue.submit(partial(self._insert_member, entry_id, member))
 
-    @check_connected
-    async def edit_or_insert_member(self, entry_id: int, member: models.Member, db=None) -> int:
+    async def edit_or_insert_member(self, entry_id: int, member: models.Member) -> int:
         '''Adds the Member member to the members table if it doesn't exist,
         or updates its number of players if it does.
 
         Returns an integer with the number of players the previous member had.
         '''
+        return await self.write_queue.submit(partial(self._edit_or_insert_member, entry_id, member))
 
-        # Check if member exists in database
-        member_cursor = await db.execute(
-            '''SELECT * FROM members
-            WHERE entry_id=?
-            AND member_id=?''',
+    async def delete_member(self, entry_id: int, member_id: int):
+        await self.write_queue.submit(partial(self._delete_member, entry_id, member_id))
+
+    async def _insert_member(self, entry_id: int, member: models.Member, db: aiosqlite.Connection):
+        await db.execute(
+            "INSERT INTO members VALUES (?, ?, ?)",
             (
                 entry_id,
-                member.user_id
+                member.user_id,
+                member.num_players
             )
         )
-        member_row = await member_cursor.fetchone()
 
-        # Create member if it doesn't exist,
-        # update number of players if it does exist
-        if member_row is None:
-            await self.insert_member(entry_id, member, db=db)
-            return None
+    async def _edit_or_insert_member(self, entry_id: int, member: models.Member, db: aiosqlite.Connection) -> int:
+        # The write queue runs this in an immediate transaction, which holds
+        # the write lock, so the member can't change between the two statements.
+        cursor = await db.execute(
+            "SELECT num_players FROM members WHERE entry_id=? AND member_id=?",
+            (entry_id, member.user_id)
+        )
+        previous_row = await cursor.fetchone()
 
         await db.execute(
             '''
-            UPDATE members
-            SET num_players=?
-            WHERE entry_id=?
-            AND member_id=?
+            INSERT INTO members VALUES (?, ?, ?)
+            ON CONFLICT (member_id, entry_id) DO UPDATE SET num_players=excluded.num_players
             ''',
             (
-                member.num_players,
                 entry_id,
-                member.user_id
+                member.user_id,
+                member.num_players
             )
         )
-        await db.commit()
-        return member_row[2]
+        if previous_row is None:
+            return None
+        return previous_row[0]
 
-    @check_connected
-    async def delete_member(self, entry_id: int, member_id: int, db=None):
+    async def _delete_member(self, entry_id: int, member_id: int, db: aiosqlite.Connection):
         await db.execute(
             "DELETE FROM members WHERE entry_id=? AND member_id=?",
             (entry_id, member_id)
         )
-        await db.commit()
+
+    ############## Job methods ##############
+    async def insert_job(self, job: models.Job) -> int:
+        '''Stores the job and returns its new job_id.'''
+        return await self.write_queue.submit(partial(self._insert_job, job))
+
+    async def _insert_job(self, job: models.Job, db: aiosqlite.Connection) -> int:
+        cursor = await db.execute(
+            "INSERT INTO jobs (kind, channel_id, message_id, due_at) VALUES (?, ?, ?, ?)",
+            (job.kind.value, job.channel_id, job.message_id, job.due_at)
+        )
+        return cursor.lastrowid
+
+    async def delete_jobs(self, job_ids: List[int]):
+        await self.write_queue.submit(partial(self._delete_jobs, job_ids))
+
+    async def _delete_jobs(self, job_ids: List[int], db: aiosqlite.Connection):
+        await db.executemany(
+            "DELETE FROM jobs WHERE job_id=?", [(job_id,) for job_id in job_ids]
+        )
+
+    @check_connected
+    async def get_jobs(self, db=None) -> List[models.Job]:
+        cursor = await db.execute(
+            "SELECT job_id, kind, channel_id, message_id, due_at FROM jobs ORDER BY due_at"
+        )
+        rows = await cursor.fetchall()
+        return [models.Job(job_id, models.JobKind(kind), *rest) for job_id, kind, *rest in rows]
 
     ############## Settings methods ##############
+    # Settings are served from settings_cache, which is filled when the
+    # database is initialized and written through by insert_settings and
+    # edit_setting. The database is only queried for guilds not in the cache.
     @check_connected
     async def insert_settings(self, guild_id: int, settings: models.Settings, db=None):
         db_tuple = (guild_id,) + astuple(settings)
+        placeholders = ", ".join("?" * len(db_tuple))
         await db.execute(
-            "INSERT INTO settings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            f"INSERT INTO settings (guild_id, {SETTINGS_COLUMNS}) VALUES ({placeholders})",
             db_tuple
         )
         await db.commit()
+        self.settings_cache[guild_id] = replace(settings)
+
+    @check_connected
+    async def insert_missing_settings(self, guild_settings: Dict[int, models.Settings], db=None) -> List[int]:
+        '''Inserts the settings of the guilds that don't have settings yet, in
+        one transaction. Settings of the other guilds are left as they are.
+
+        Returns:
+            The IDs of the guilds whose settings were inserted.
+        '''
+        cursor = await db.execute("SELECT guild_id FROM settings")
+        existing_ids = {row[0] for row in await cursor.fetchall()}
+        missing_ids = [guild_id for guild_id in guild_settings if guild_id not in existing_ids]
+        if len(missing_ids) == 0:
+            return missing_ids
+
+        placeholders = ", ".join("?" * (len(fields(models.Settings)) + 1))
+        await db.executemany(
+            f"INSERT INTO settings (guild_id, {SETTINGS_COLUMNS}) VALUES ({placeholders})",
+            [(guild_id,) + astuple(guild_settings[guild_id]) for guild_id in missing_ids]
+        )
+        await db.commit()
+        for guild_id in missing_ids:
+            self.settings_cache[guild_id] = replace(guild_settings[guild_id])
+        return missing_ids
 
     @check_connected
     async def edit_setting(self, guild_id: int, settings_type: models.SettingsType, setting: str, db=None):
@@ -252,37 +694,43 @@ class Database:
         )
         await db.commit()
 
-    @check_connected
-    async def get_setting(self, guild_id: int, setting: models.SettingsType, db=None):
-        db_key = setting.to_string()
-        cursor = await db.execute(
-            f'SELECT {db_key} FROM settings WHERE guild_id=?',
-            (guild_id,)
-        )
-        row = await cursor.fetchone()
-        if row is None:
+        # Read the row back so the cache gets the value as SQLite stored it
+        await self.load_settings(guild_id, db=db)
+
+    async def get_setting(self, guild_id: int, setting: models.SettingsType):
+        settings = await self.get_settings(guild_id)
+        if settings is None:
             raise Exception(f"Could not get setting {setting} from guild with id {guild_id}.")
-        return row[0]
+        return getattr(settings, setting.to_string())
+
+    async def get_settings(self, guild_id: int) -> models.Settings:
+        settings = self.settings_cache.get(guild_id)
+        if settings is not None:
+            self.settings_cache_stats.hits += 1
+        else:
+            self.settings_cache_stats.misses += 1
+            settings = await self.load_settings(guild_id)
+            if settings is None:
+                return None
+        return replace(settings)
 
     @check_connected
-    async def get_settings(self, guild_id: int, db=None) -> models.Settings:
+    async def load_settings(self, guild_id: int, db=None) -> models.Settings:
+        '''Reads the settings of a guild from the database into the settings cache.'''
         cursor = await db.execute(
-            '''
-                SELECT
-                    use_channel,
-                    waiting_channel,
-                    end_channel,
-                    delete_general_delay,
-                    delete_use_delay,
-                    delete_end_delay,
-                    cancel_delay,
-                    timezone
-                FROM settings
-                WHERE guild_id=?
-            ''',
+            f"SELECT {SETTINGS_COLUMNS} FROM settings WHERE guild_id=?",
             (guild_id,)
         )
         row = await cursor.fetchone()
         if row is None:
             return None
-        return models.Settings(*row)
+        settings = models.Settings(*row)
+        self.settings_cache[guild_id] = settings
+        return settings
+
+    @check_connected
+    async def load_all_settings(self, db=None):
+        '''Replaces the contents of the settings cache with all settings in the database.'''
+        cursor = await db.execute(f"SELECT guild_id, {SETTINGS_COLUMNS} FROM settings")
+        rows = await cursor.fetchall()
+        self.settings_cache = {row[0]: models.Settings(*row[1:]) for row in rows}
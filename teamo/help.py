@@ -1,18 +1,18 @@
 import discord
 from discord.ext.commands.help import DefaultHelpCommand
 
-from teamo import database, models
+from teamo import database, models, jobs
 
 class TeamoHelpCommand(DefaultHelpCommand):
-    def __init__(self, db: database.Database, **options):
+    def __init__(self, db: database.Database, job_executor: jobs.JobExecutor, **options):
         super().__init__(**options)
         self.db = db
+        self.job_executor = job_executor
 
     async def send_pages(self):
         destination: discord.TextChannel = self.get_destination()
         delete_delay = await self.db.get_setting(destination.guild.id, models.SettingsType.DELETE_GENERAL_DELAY)
         for page in self.paginator.pages:
+            message = await destination.send(page)
             if delete_delay >= 0:
-                await destination.send(page, delete_after=delete_delay)
-            else:
-                await destination.send(page)
+                await self.job_executor.schedule(models.JobKind.DELETE_MESSAGE, destination.id, message.id, delete_delay)
@@ -0,0 +1,76 @@
+import logging
+from math import ceil
+from time import time
+from typing import Awaitable, Callable, Dict, List
+
+from teamo import database, models, scheduler
+
+
+JobHandler = Callable[[List[models.Job]], Awaitable]
+
+
+class JobExecutor:
+    ''' Runs delayed jobs that are stored in the database, so that pending
+    cancellations and message deletions survive a restart.
+
+    Each kind of job has a handler, which is called with all jobs of that
+    kind that are due at the same time, so that e.g. message deletions can be
+    grouped. Due times are rounded up to whole seconds to let jobs scheduled
+    close to each other run together.
+    '''
+
+    def __init__(self, db: database.Database, handlers: Dict[models.JobKind, JobHandler]):
+        self.db: database.Database = db
+        self.handlers: Dict[models.JobKind, JobHandler] = handlers
+        self.scheduler = scheduler.DeadlineScheduler()
+        self.jobs: Dict[int, models.Job] = dict()
+
+    async def restore(self) -> List[models.Job]:
+        ''' Schedules the jobs stored in the database. Jobs that became due
+        while Teamo wasn't running are run right away. '''
+        self.scheduler.clear()
+        self.jobs = dict()
+        jobs = await self.db.get_jobs()
+        for job in jobs:
+            self._schedule(job)
+        logging.info(f"Restored {len(jobs)} pending jobs.")
+        return jobs
+
+    async def schedule(self, kind: models.JobKind, channel_id: int, message_id: int, delay: float) -> models.Job:
+        job = models.Job(
+            kind=kind,
+            channel_id=channel_id,
+            message_id=message_id,
+            due_at=ceil(time() + max(delay, 0))
+        )
+        job.job_id = await self.db.insert_job(job)
+        self._schedule(job)
+        return job
+
+    async def cancel(self, job_id: int):
+        if self.jobs.pop(job_id, None) is None:
+            return
+        self.scheduler.unschedule(job_id)
+        await self.db.delete_jobs([job_id])
+
+    async def run(self):
+        while True:
+            due = await self.scheduler.wait_due()
+            jobs = [self.jobs.pop(job_id) for job_id, _ in due]
+            for kind, handler in self.handlers.items():
+                kind_jobs = [job for job in jobs if job.kind == kind]
+                if len(kind_jobs) == 0:
+                    continue
+                try:
+                    await handler(kind_jobs)
+                except Exception:
+                    logging.exception(f"Failed to run {len(kind_jobs)} {kind.value} jobs.")
+            try:
+                await self.db.delete_jobs([job.job_id for job in jobs])
+            except Exception:
+                # The jobs are run again after a restart
+                logging.exception(f"Failed to delete {len(jobs)} jobs that have run.")
+
+    def _schedule(self, job: models.Job):
+        self.jobs[job.job_id] = job
+        self.scheduler.schedule(job.job_id, job.due_at)
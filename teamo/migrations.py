@@ -0,0 +1,200 @@
+''' Versioned schema migrations for the Teamo database.
+
+The schema version of a database file is stored in the SQLite user_version
+pragma. Migration number N (1-indexed) in MIGRATIONS upgrades a database from
+version N-1 to version N. Each migration runs in its own transaction, together
+with the user_version update, so a failed migration leaves the file untouched.
+
+Migrations must be run with foreign key enforcement turned off, since some of
+them rebuild tables that other tables refer to.
+'''
+import logging
+
+import aiosqlite
+
+from teamo import models
+
+
+async def create_tables(db: aiosqlite.Connection):
+    ''' The original schema. Databases created before user_version was
+    tracked already have these tables. '''
+    await db.execute('''CREATE TABLE IF NOT EXISTS entries (
+        entry_id integer primary key,
+        channel_id integer,
+        server_id integer,
+        game text,
+        start_date timestamp,
+        max_players integer
+        )''')
+
+    await db.execute('''CREATE TABLE IF NOT EXISTS members (
+        entry_id integer,
+        member_id integer,
+        num_players integer,
+        primary key (member_id, entry_id)
+        foreign key (entry_id) references entries (entry_id)
+        )''')
+
+    await db.execute('''CREATE TABLE IF NOT EXISTS settings (
+        guild_id integer primary key,
+        use_channel integer,
+        waiting_channel integer,
+        end_channel integer,
+        delete_general_delay integer,
+        delete_use_delay integer,
+        delete_end_delay integer,
+        cancel_delay integer,
+        timezone text
+        )''')
+
+
+async def add_indexes_and_cascading_deletes(db: aiosqlite.Connection):
+    ''' Index members by entry and entries by start date, and delete members
+    together with their entry. '''
+
+    # SQLite cannot alter a foreign key, so the members table is rebuilt.
+    # Members without an entry would violate the new foreign key and are dropped.
+    await db.execute('''CREATE TABLE members_new (
+        entry_id integer,
+        member_id integer,
+        num_players integer,
+        primary key (member_id, entry_id),
+        foreign key (entry_id) references entries (entry_id) on delete cascade
+        )''')
+    await db.execute('''
+        INSERT INTO members_new
+        SELECT entry_id, member_id, num_players FROM members
+        WHERE entry_id IN (SELECT entry_id FROM entries)
+        ORDER BY rowid
+    ''')
+    await db.execute("DROP TABLE members")
+    await db.execute("ALTER TABLE members_new RENAME TO members")
+
+    await db.execute("CREATE INDEX idx_members_entry_id ON members (entry_id)")
+    await db.execute("CREATE INDEX idx_entries_start_date ON entries (start_date)")
+
+
+async def store_start_date_as_utc_timestamp(db: aiosqlite.Connection):
+    ''' Store start_date as UTC epoch seconds instead of a naive timestamp
+    in the server's time zone. '''
+    await db.execute('''CREATE TABLE entries_new (
+        entry_id integer primary key,
+        channel_id integer,
+        server_id integer,
+        game text,
+        start_date integer,
+        max_players integer
+        )''')
+
+    # The naive start dates are converted using the time zone of the server
+    cursor = await db.execute('''
+        SELECT entries.*, settings.timezone
+        FROM entries
+        LEFT JOIN settings ON settings.guild_id = entries.server_id
+    ''')
+    rows = []
+    for *entry_row, timezone in await cursor.fetchall():
+        settings = models.Settings() if timezone is None else models.Settings(timezone=timezone)
+        start_date = entry_row[4].replace(tzinfo=settings.get_tzinfo())
+        entry_row[4] = int(start_date.timestamp())
+        rows.append(entry_row)
+    await db.executemany("INSERT INTO entries_new VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    # Foreign key enforcement is off, so members are kept. The members table
+    # refers to the entries table by name, so it refers to the new table once renamed.
+    await db.execute("DROP TABLE entries")
+    await db.execute("ALTER TABLE entries_new RENAME TO entries")
+    await db.execute("CREATE INDEX idx_entries_start_date ON entries (start_date)")
+
+
+async def add_archive_tables(db: aiosqlite.Connection):
+    ''' Finished, cancelled and deleted entries are moved to these tables. '''
+    await db.execute('''CREATE TABLE entry_archive (
+        entry_id integer primary key,
+        channel_id integer,
+        server_id integer,
+        game text,
+        start_date integer,
+        max_players integer,
+        archived_at integer,
+        reason text
+        )''')
+
+    await db.execute('''CREATE TABLE member_archive (
+        entry_id integer,
+        member_id integer,
+        num_players integer,
+        primary key (member_id, entry_id),
+        foreign key (entry_id) references entry_archive (entry_id) on delete cascade
+        )''')
+
+    await db.execute("CREATE INDEX idx_entry_archive_archived_at ON entry_archive (archived_at)")
+    await db.execute("CREATE INDEX idx_member_archive_entry_id ON member_archive (entry_id)")
+
+
+async def add_client_timestamps_setting(db: aiosqlite.Connection):
+    await db.execute("ALTER TABLE settings ADD COLUMN client_timestamps integer DEFAULT 0")
+
+
+async def add_jobs_table(db: aiosqlite.Connection):
+    ''' Delayed cancellations and message deletions '''
+    await db.execute('''CREATE TABLE jobs (
+        job_id integer primary key,
+        kind text,
+        channel_id integer,
+        message_id integer,
+        due_at integer
+        )''')
+
+
+MIGRATIONS = [
+    create_tables,
+    add_indexes_and_cascading_deletes,
+    store_start_date_as_utc_timestamp,
+    add_archive_tables,
+    add_client_timestamps_setting,
+    add_jobs_table,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+async def get_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    return row[0]
+
+
+async def migrate(db: aiosqlite.Connection):
+    ''' Upgrades the database to the latest schema version. '''
+    version = await get_version(db)
+    if version > LATEST_VERSION:
+        raise Exception(f"Database schema version {version} is newer than the latest version known by this version of Teamo ({LATEST_VERSION}).")
+
+    for new_version in range(version + 1, LATEST_VERSION + 1):
+        migration = MIGRATIONS[new_version - 1]
+        logging.info(f"Migrating database to schema version {new_version} ({migration.__name__}).")
+        await db.execute("BEGIN")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {new_version}")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+    await enable_incremental_vacuum(db)
+
+
+async def enable_incremental_vacuum(db: aiosqlite.Connection):
+    ''' Lets pages freed by deletes be returned to the file system with
+    PRAGMA incremental_vacuum. Changing the auto_vacuum mode of an existing
+    database file requires a full VACUUM, which is only done once. '''
+    cursor = await db.execute("PRAGMA auto_vacuum")
+    row = await cursor.fetchone()
+    if row[0] == 2:  # INCREMENTAL
+        return
+
+    logging.info("Enabling incremental vacuum for the database.")
+    await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    await db.execute("VACUUM")
@@ -1,8 +1,7 @@
-from typing import List
+from typing import Dict, List, NamedTuple, Set
 from datetime import datetime, tzinfo
 from dataclasses import dataclass, field
 from enum import Enum, auto
-from copy import copy
 
 from dateutil import tz
 
@@ -13,13 +12,47 @@ class Member:
     num_players: int
 
 
+@dataclass
+class ReactionState:
+    ''' The number emojis each user has reacted with on a Teamo message.
+
+    Kept up to date from the raw reaction events, so that the reactions of a
+    user can be removed without fetching the message. Reactions added while
+    Teamo wasn't running are not known, so on startup the state is created
+    from the registered members (see from_members).
+    '''
+
+    user_emojis: Dict[int, Set[str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_members(cls, members: List[Member], emojis: List[str]):
+        ''' Assumes that each member has reacted with emojis[num_players - 1] '''
+        return cls({member.user_id: {emojis[member.num_players - 1]} for member in members})
+
+    def add(self, user_id: int, emoji: str):
+        self.user_emojis.setdefault(user_id, set()).add(emoji)
+
+    def remove(self, user_id: int, emoji: str):
+        emojis = self.user_emojis.get(user_id)
+        if emojis is None:
+            return
+        emojis.discard(emoji)
+        if len(emojis) == 0:
+            del self.user_emojis[user_id]
+
+    def get_other_emojis(self, user_id: int, emoji: str) -> List[str]:
+        ''' Returns the emojis other than emoji that the user has reacted with '''
+        return sorted(self.user_emojis.get(user_id, set()) - {emoji})
+
+
 @dataclass
 class Entry:
     ''' Class for storing information of a single Teamo entry.
 
-    Instances of this class should be created with the create_with_tz class
-    method, and not by the default constructor (as the latter will yield a
-    non-aware datetime object)
+    The start_date is stored in the database as a UTC epoch timestamp.
+    Instances created from a database row should be created with the
+    create_from_timestamp class method, which converts it to an aware
+    datetime object in the server's time zone.
     '''
 
     message_id: int = None
@@ -31,15 +64,13 @@ class Entry:
     members: List[Member] = field(default_factory=list)
 
     @classmethod
-    def create_with_tz(cls, *args, tzinfo: tzinfo):
-        d: datetime = args[4]  # start_date argument
-        d = d.replace(tzinfo=tzinfo)
+    def create_from_timestamp(cls, *args, tzinfo: tzinfo):
+        timestamp: int = args[4]  # start_date argument
+        d = datetime.fromtimestamp(timestamp, tz=tzinfo)
         return cls(*args[0:4], d, *args[5:])
 
-    def with_naive_datetime(self):
-        new_entry = copy(self)
-        new_entry.start_date = new_entry.start_date.replace(tzinfo=None)
-        return new_entry
+    def get_start_timestamp(self) -> int:
+        return int(self.start_date.timestamp())
 
 class SettingsType(Enum):
     USE_CHANNEL = auto()
@@ -50,6 +81,7 @@ class SettingsType(Enum):
     DELETE_END_DELAY = auto()
     CANCEL_DELAY = auto()
     TIMEZONE = auto()
+    CLIENT_TIMESTAMPS = auto()
 
     @classmethod
     def from_string(cls, v: str):
@@ -61,6 +93,7 @@ class SettingsType(Enum):
         elif v == 'delete_end_delay': return cls.DELETE_END_DELAY
         elif v == 'cancel_delay': return cls.CANCEL_DELAY
         elif v == 'timezone': return cls.TIMEZONE
+        elif v == 'client_timestamps': return cls.CLIENT_TIMESTAMPS
         else: return None
 
     def to_string(self) -> str:
@@ -72,6 +105,7 @@ class SettingsType(Enum):
         elif self == self.DELETE_END_DELAY: return 'delete_end_delay'
         elif self == self.CANCEL_DELAY: return 'cancel_delay'
         elif self == self.TIMEZONE: return 'timezone'
+        elif self == self.CLIENT_TIMESTAMPS: return 'client_timestamps'
         else: return None
 
     def is_channel_id(self) -> bool:
@@ -79,6 +113,9 @@ class SettingsType(Enum):
             return True
         return False
 
+    def is_bool(self) -> bool:
+        return self == self.CLIENT_TIMESTAMPS
+
 @dataclass
 class Settings:
     ''' Class for holding per-server settings
@@ -92,6 +129,7 @@ class Settings:
         delete_end_delay (int) Number of seconds after an "end" message has been posted that it will be deleted. < 0 -> Message will never be deleted. Default: 0
         cancel_delay (int) Number of seconds after a cancel reaction has been pressed that the message will be deleted. < 0 -> Message will be deleted immediately. Default: 15
         timezone (str) The timezone of the server, specified as a IANA timezone database name. Default: "Europe/Stockholm"
+        client_timestamps (bool) Whether the start time and time left of Teamo messages are rendered by the Discord client. Messages are then only updated when someone registers. Default: False
     '''
     use_channel: int = None
     waiting_channel: int = None
@@ -101,6 +139,36 @@ class Settings:
     delete_end_delay: int = 60 * 60
     cancel_delay: int = 30
     timezone: str = "Europe/Stockholm"
+    client_timestamps: bool = False
 
     def get_tzinfo(self) -> tzinfo:
         return tz.gettz(self.timezone)
+
+
+class JobKind(Enum):
+    CANCEL_ENTRY = "cancel_entry"
+    DELETE_MESSAGE = "delete_message"
+
+@dataclass
+class Job:
+    ''' A delayed action that is stored in the database, so that it is run even if Teamo restarts
+
+    Attributes:
+        job_id (int) Unique ID of the job, assigned by the database.
+        kind (JobKind) What to do when the job is due.
+        channel_id (int) The channel of the message the job acts on.
+        message_id (int) The message (and for CANCEL_ENTRY jobs, the entry) the job acts on.
+        due_at (int) UNIX timestamp of when the job should run.
+    '''
+    job_id: int = None
+    kind: JobKind = None
+    channel_id: int = None
+    message_id: int = None
+    due_at: int = None
+
+
+class MessageHandle(NamedTuple):
+    ''' The IDs needed to edit, react to or delete a Teamo message without
+    keeping the full discord.Message around. '''
+    channel_id: int
+    message_id: int
@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+from time import time
+from typing import Dict, Hashable, List, Tuple
+
+
+class DeadlineScheduler:
+    ''' Keeps one deadline per key and sleeps until the earliest deadline has passed.
+
+    Deadlines are UNIX timestamps (seconds). Scheduling a key again replaces
+    its deadline. Replaced and unscheduled deadlines are left in the heap and
+    skipped when they reach the top, so every operation is O(log n).
+    '''
+
+    def __init__(self, max_sleep: float = None):
+        '''
+        Arguments:
+            max_sleep (float) The longest time wait_due sleeps before checking
+                the clock again, which bounds the effect of system clock changes.
+                None -> Sleep until the next deadline.
+        '''
+        self.max_sleep: float = max_sleep
+        self._heap: List[Tuple[float, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = dict()
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: Hashable, deadline: float):
+        if self._deadlines.get(key) == deadline:
+            return
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        self._changed.set()
+
+    def unschedule(self, key: Hashable):
+        if self._deadlines.pop(key, None) is not None:
+            self._changed.set()
+
+    def clear(self):
+        self._heap = []
+        self._deadlines = dict()
+        self._changed.set()
+
+    def get_deadline(self, key: Hashable) -> float:
+        return self._deadlines.get(key)
+
+    def next_deadline(self) -> float:
+        self._discard_stale()
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][0]
+
+    def pop_due(self, now: float) -> List[Tuple[Hashable, float]]:
+        ''' Removes and returns the (key, deadline) pairs with deadlines at or before now '''
+        due = []
+        while self.next_deadline() is not None and self._heap[0][0] <= now:
+            deadline, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append((key, deadline))
+        return due
+
+    async def wait_due(self) -> List[Tuple[Hashable, float]]:
+        ''' Waits until at least one deadline has passed and returns the due
+        (key, deadline) pairs in deadline order. '''
+        while True:
+            self._changed.clear()
+            now = time()
+            due = self.pop_due(now)
+            if len(due) > 0:
+                return due
+
+            timeout = self.max_sleep
+            next_deadline = self.next_deadline()
+            if next_deadline is not None:
+                timeout = next_deadline - now if timeout is None else min(timeout, next_deadline - now)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _discard_stale(self):
+        while len(self._heap) > 0:
+            deadline, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self._heap)
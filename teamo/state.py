@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from enum import Enum, auto
+from typing import Awaitable, Callable, Dict, List
+
+from teamo import models
+
+
+# Queue depth at which an entry is logged as falling behind its events
+QUEUE_DEPTH_WARNING = 50
+
+
+class EntryEventKind(Enum):
+    REACTION_ADD = auto()
+    REACTION_REMOVE = auto()
+    # The message should be rendered again
+    REFRESH = auto()
+    # The cancellation delay has passed
+    CANCEL = auto()
+    # The start time has passed
+    FINISH = auto()
+
+
+@dataclass
+class EntryEvent:
+    kind: EntryEventKind
+    user_id: int = None
+    emoji: str = None
+    # The time the event was due, for FINISH events
+    deadline: float = None
+    # The job that fired, for CANCEL events
+    job_id: int = None
+
+
+@dataclass
+class EntryState:
+    ''' The runtime state of an active Teamo entry.
+
+    It lives from when the Teamo message is created (or found on startup)
+    until the entry is finished, cancelled or deleted, after which it is
+    evicted from the EntryRegistry.
+
+    Each entry is owned by an actor task, which runs the events sent to the
+    entry one batch at a time. All changes to an entry go through its
+    events, so they never run concurrently and no locks are needed.
+    '''
+
+    handle: models.MessageHandle
+    reactions: models.ReactionState = field(default_factory=models.ReactionState)
+    # Fingerprint of the last embed sent, see utils.get_embed_fingerprint
+    embed_fingerprint: str = None
+    # Job ID of the pending cancellation. None -> Not cancelling
+    cancel_job_id: int = None
+    # Events waiting to be run by the actor. None -> Stop the actor
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    task: asyncio.Task = None
+
+    def is_cancelling(self) -> bool:
+        return self.cancel_job_id is not None
+
+    def is_pending_cancel(self, job_id: int) -> bool:
+        ''' Whether the job is the pending cancellation of the entry, i.e. it
+        hasn't been aborted since it was scheduled '''
+        return job_id is not None and job_id == self.cancel_job_id
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def send(self, event: EntryEvent):
+        self.queue.put_nowait(event)
+        if self.queue_depth() == QUEUE_DEPTH_WARNING:
+            logging.warning(f"{QUEUE_DEPTH_WARNING} events are waiting for entry {self.handle.message_id}.")
+
+    def start(self, handler: Callable[['EntryState', List[EntryEvent]], Awaitable]):
+        self.task = asyncio.create_task(self.run(handler))
+
+    def stop(self):
+        ''' Stops the actor after the batch it is running. Events sent after
+        this are never run. '''
+        self.queue.put_nowait(None)
+
+    async def run(self, handler: Callable[['EntryState', List[EntryEvent]], Awaitable]):
+        ''' Runs the events until the actor is stopped. Events that are sent
+        while a batch is running are run together as the next batch. '''
+        while True:
+            events = [await self.queue.get()]
+            while not self.queue.empty():
+                events.append(self.queue.get_nowait())
+            stopped = None in events
+            if stopped:
+                events = events[:events.index(None)]
+            if len(events) > 0:
+                try:
+                    await handler(self, events)
+                except Exception:
+                    logging.exception(f"Failed to handle {len(events)} events for entry {self.handle.message_id}.")
+            if stopped:
+                return
+
+
+class EntryRegistry:
+    ''' Holds the EntryState of every active entry, keyed by message ID.
+
+    States are added when an entry becomes active and evicted when it ends,
+    so memory use follows the number of active entries rather than the
+    number of entries ever created. The actor of an entry is started when it
+    is added, with the handler given to the registry, and stopped when it is
+    evicted.
+    '''
+
+    def __init__(self, handler: Callable[[EntryState, List[EntryEvent]], Awaitable]):
+        self.handler = handler
+        self._states: Dict[int, EntryState] = dict()
+        self.num_added: int = 0
+        self.num_evicted: int = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._states
+
+    def add(self, state: EntryState) -> EntryState:
+        ''' Adds the state of an entry. If the entry already has a state, it
+        is evicted first, so that its actor is stopped. '''
+        self.evict(state.handle.message_id)
+        self._states[state.handle.message_id] = state
+        self.num_added += 1
+        state.start(self.handler)
+        return state
+
+    def get(self, message_id: int) -> EntryState:
+        return self._states.get(message_id)
+
+    def send(self, message_id: int, event: EntryEvent) -> bool:
+        ''' Sends the event to the entry. Returns False if the entry isn't active. '''
+        state = self._states.get(message_id)
+        if state is None:
+            return False
+        state.send(event)
+        return True
+
+    def evict(self, message_id: int) -> EntryState:
+        state = self._states.pop(message_id, None)
+        if state is not None:
+            state.stop()
+            self.num_evicted += 1
+        return state
+
+    def num_live(self) -> int:
+        ''' Gauge of the number of active entries '''
+        return len(self._states)
+
+    def max_queue_depth(self) -> int:
+        ''' Gauge of the longest event queue, which grows when events arrive
+        faster than the entry can handle them '''
+        return max((state.queue_depth() for state in self._states.values()), default=0)
@@ -0,0 +1,122 @@
+import logging
+from dataclasses import replace
+from datetime import datetime, tzinfo
+from typing import Dict, List
+
+from teamo import database, models
+
+
+class EntryStore:
+    ''' Keeps all active entries in memory, in front of the database.
+
+    Teamo is the only writer of its database, so after the entries have been
+    loaded once on startup, all reads are served from memory. Writes go
+    through to the database first and are applied in memory when they have
+    succeeded, so the database stays the backing store that the entries are
+    loaded from after a restart.
+
+    Entries returned by the store are copies, and changes to them are not
+    stored unless they are written through the store.
+    '''
+
+    def __init__(self, db: database.Database):
+        self.db: database.Database = db
+        self._entries: Dict[int, models.Entry] = dict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._entries
+
+    async def load(self) -> List[models.Entry]:
+        entries = await self.db.get_all_entries()
+        self._entries = {entry.message_id: entry for entry in entries}
+        return self.get_all()
+
+    def set_server_timezone(self, server_id: int, tz: tzinfo):
+        ''' Shows the start dates of the server's entries in its new time
+        zone. The start dates are stored as points in time, so the database
+        doesn't change. '''
+        for entry in self._entries.values():
+            if entry.server_id == server_id:
+                entry.start_date = entry.start_date.astimezone(tz)
+
+    ############## Reads ##############
+    def get(self, message_id: int) -> models.Entry:
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        return self._copy(entry)
+
+    def get_all(self) -> List[models.Entry]:
+        return [self._copy(entry) for entry in self._entries.values()]
+
+    def get_server_entries(self, server_id: int) -> List[models.Entry]:
+        return [self._copy(entry) for entry in self._entries.values() if entry.server_id == server_id]
+
+    def get_member(self, message_id: int, user_id: int) -> models.Member:
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        member = next((m for m in entry.members if m.user_id == user_id), None)
+        return None if member is None else replace(member)
+
+    ############## Writes ##############
+    async def insert(self, entry: models.Entry):
+        await self.db.insert_entry(entry)
+        # Store the start date as it is read back from the database
+        start_date = datetime.fromtimestamp(entry.get_start_timestamp(), tz=entry.start_date.tzinfo)
+        self._entries[entry.message_id] = replace(self._copy(entry), start_date=start_date)
+
+    async def edit_or_insert_member(self, message_id: int, member: models.Member) -> int:
+        ''' See Database.edit_or_insert_member '''
+        previous_num_players = await self.db.edit_or_insert_member(message_id, member)
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            index = next((i for i, m in enumerate(entry.members) if m.user_id == member.user_id), None)
+            if index is None:
+                entry.members.append(replace(member))
+            else:
+                entry.members[index] = replace(member)
+        return previous_num_players
+
+    async def delete_member(self, message_id: int, user_id: int):
+        await self.db.delete_member(message_id, user_id)
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            entry.members = [m for m in entry.members if m.user_id != user_id]
+
+    async def archive(self, message_id: int, reason: str):
+        await self.archive_many([message_id], reason)
+
+    async def archive_many(self, message_ids: List[int], reason: str):
+        await self.db.archive_entries(message_ids, reason)
+        for message_id in message_ids:
+            self._entries.pop(message_id, None)
+
+    ############## Debugging ##############
+    async def check_consistency(self) -> List[str]:
+        ''' Compares the entries in memory with the entries in the database.
+
+        Returns:
+            A description of each difference found. Empty if the store and
+            the database are consistent.
+        '''
+        db_entries = {entry.message_id: entry for entry in await self.db.get_all_entries()}
+        differences = []
+        for message_id in self._entries.keys() - db_entries.keys():
+            differences.append(f"Entry {message_id} is in memory but not in the database")
+        for message_id in db_entries.keys() - self._entries.keys():
+            differences.append(f"Entry {message_id} is in the database but not in memory")
+        for message_id in self._entries.keys() & db_entries.keys():
+            if self._entries[message_id] != db_entries[message_id]:
+                differences.append(
+                    f"Entry {message_id} differs. Memory: {self._entries[message_id]}, database: {db_entries[message_id]}")
+        for difference in differences:
+            logging.warning(difference)
+        return differences
+
+    @staticmethod
+    def _copy(entry: models.Entry) -> models.Entry:
+        return replace(entry, members=[replace(member) for member in entry.members])
@@ -1,5 +1,7 @@
 import dataclasses
 from datetime import datetime, timedelta
+import hashlib
+import json
 from math import floor
 import os
 
@@ -16,6 +18,12 @@ def get_update_interval():
 def get_check_interval():
     return int(os.getenv('TEAMO_CHECK_INTERVAL'))
 
+def get_edit_delay():
+    return float(os.getenv('TEAMO_EDIT_DELAY'))
+
+def get_archive_retention_days():
+    return int(os.getenv('TEAMO_ARCHIVE_RETENTION_DAYS'))
+
 def get_date_string(date: datetime, show_date: bool = True) -> str:
     if not show_date:
         return date.strftime("%H:%M:%S")
@@ -49,16 +57,48 @@ def get_timedelta_string(td: timedelta) -> str:
     return f"{days} days {hours} h {mins} min"
 
 
-def create_embed(entry: Entry, cancel_delay: int = 0, is_cancelling: bool = False) -> discord.Embed:
-    date_string = get_date_string(entry.start_date)
+def get_refresh_stagger(message_id: int) -> float:
+    ''' A delay in [0, update interval) that is fixed for each message, used
+    to spread the refreshes of messages whose time left changes at the same time '''
+    # Multiplicative hashing spreads consecutive IDs over the interval
+    fraction = ((message_id * 2654435761) % 2**32) / 2**32
+    return fraction * max(get_update_interval(), 0)
+
+
+def get_next_refresh_delay(td: timedelta, stagger: float = 0) -> float:
+    ''' The number of seconds until get_timedelta_string(td) changes, plus stagger.
+
+    Returns None if the string will not change before td has passed.
+    '''
+    tot_secs = td.total_seconds()
+    if tot_secs < 60:
+        return None
+    # The string shows whole minutes
+    return tot_secs - floor(tot_secs / 60) * 60 + stagger
+
+
+def create_embed(entry: Entry, cancel_delay: int = 0, is_cancelling: bool = False, client_timestamps: bool = False) -> discord.Embed:
+    ''' Creates the embed of a "waiting" message.
+
+    If client_timestamps is True, the start time and time left are sent as
+    Discord timestamp markup, which the Discord client renders (and keeps up
+    to date) in the time zone of each user.
+    '''
+    if client_timestamps:
+        start_timestamp = entry.get_start_timestamp()
+        date_string = f"<t:{start_timestamp}:F>"
+        time_left_string = f"<t:{start_timestamp}:R>"
+    else:
+        date_string = get_date_string(entry.start_date)
+        tl: timedelta = entry.start_date - datetime.now(tz=entry.start_date.tzinfo)
+        time_left_string = get_timedelta_string(tl)
     embed = discord.Embed(
         title="Time for **{}**!!".format(entry.game),
         description=f"**Start: {date_string}** - To subscribe, select the #️⃣ reaction below with the number of players in your group. To cancel the event, select the {cancel_emoji} reaction."
     )
     embed.color = discord.Color.purple()
-    tl: timedelta = entry.start_date - datetime.now(tz=entry.start_date.tzinfo)
     embed.add_field(name="Time left",
-                    value=get_timedelta_string(tl), inline=False)
+                    value=time_left_string, inline=False)
     embed.add_field(name="Players per team",
                     value=entry.max_players, inline=False)
 
@@ -84,14 +124,22 @@ def create_embed(entry: Entry, cancel_delay: int = 0, is_cancelling: bool = Fals
         footer_text += f"ID: {entry.message_id}\n"
     timezone = entry.start_date.tzinfo
     footer_text += f"Last updated: {datetime.now(tz=timezone).strftime('%Y-%m-%d %H:%M:%S')}"
-    update_interval = get_update_interval()
-    if update_interval > 0:
-        footer_text += f" (updated every {update_interval} seconds)"
     embed.set_footer(text=footer_text)
 
     return embed
 
 
+def get_embed_fingerprint(embed: discord.Embed) -> str:
+    ''' A digest of the visible content of an embed, excluding the footer.
+
+    The footer only holds the message ID and the "Last updated" time, so two
+    embeds with the same fingerprint look the same to users.
+    '''
+    embed_dict = embed.to_dict()
+    embed_dict.pop("footer", None)
+    return hashlib.sha1(json.dumps(embed_dict, sort_keys=True).encode("utf8")).hexdigest()
+
+
 number_emojis = [
     "1️⃣",
     "2️⃣",
@@ -0,0 +1,17 @@
+import tempfile
+
+import pytest
+
+from teamo.database import Database
+
+@pytest.fixture
+def db_name():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield f"{tmpdirname}/test.db"
+
+@pytest.fixture
+async def db(db_name: str):
+    db = Database(db_name)
+    await db.init()
+    yield db
+    await db.close()
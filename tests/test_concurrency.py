@@ -0,0 +1,32 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from teamo.concurrency import KeyedLimiter
+
+
+@pytest.mark.asyncio
+async def test_keyed_limiter():
+    limiter = KeyedLimiter(per_key=2, total=3)
+    running = Counter()
+    max_running = Counter()
+
+    async def operation(key: str):
+        async with limiter.acquire(key):
+            running[key] += 1
+            running["total"] += 1
+            max_running[key] = max(max_running[key], running[key])
+            max_running["total"] = max(max_running["total"], running["total"])
+            await asyncio.sleep(0.01)
+            running[key] -= 1
+            running["total"] -= 1
+
+    await asyncio.gather(*[operation(key) for key in "aaaaabbbbc"])
+    assert max_running["a"] == 2
+    assert max_running["b"] == 2
+    assert max_running["c"] == 1
+    assert max_running["total"] == 3
+
+    # Semaphores of idle keys are dropped
+    assert limiter.num_keys() == 0
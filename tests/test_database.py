@@ -1,19 +1,14 @@
-import tempfile
-from datetime import datetime
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
 import dataclasses
 
 import pytest
+from dateutil import tz
 
-from teamo.database import Database
+from teamo.database import Database, STORAGE_PROFILES
 from teamo import models
 
-@pytest.fixture
-async def db():
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        db = Database(f"{tmpdirname}/test.db")
-        await db.init()
-        yield db
-
 @pytest.mark.asyncio
 async def test_insert_entry(db: Database):
     server_id = 0
@@ -24,7 +19,7 @@ async def test_insert_entry(db: Database):
         channel_id = 0,
         server_id = server_id,
         game = "Testgame",
-        start_date = datetime.now(tz=settings.get_tzinfo()),
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
         max_players = 1
     )
 
@@ -59,7 +54,7 @@ async def test_delete_member(db):
         channel_id = 0,
         server_id = server_id,
         game = "Testgame",
-        start_date = datetime.now(tz=settings.get_tzinfo()),
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
         max_players = 4
     )
 
@@ -98,7 +93,7 @@ async def test_get_member(db):
         channel_id = 0,
         server_id = server_id,
         game = "Testgame",
-        start_date = datetime.now(tz=settings.get_tzinfo()),
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
         max_players = 4
     )
     member1 = models.Member(1, 3)
@@ -123,7 +118,7 @@ async def test_insert_member(db):
         channel_id = 0,
         server_id = server_id,
         game = "Testgame",
-        start_date = datetime.now(tz=settings.get_tzinfo()),
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
         max_players = 1
     )
 
@@ -158,7 +153,7 @@ async def test_delete_entry(db):
         channel_id = 0,
         server_id = server_id,
         game = "Testgame",
-        start_date = datetime.now(tz=settings.get_tzinfo()),
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
         max_players = 1
     )
 
@@ -223,3 +218,258 @@ async def test_settings(db: Database):
     assert db_settings_edited.delete_use_delay == 2
     assert db_settings_edited.delete_end_delay == 7
     assert db_settings_edited.cancel_delay == 12
+    assert not db_settings_edited.client_timestamps
+
+    await db.edit_setting(0, models.SettingsType.CLIENT_TIMESTAMPS, "1")
+    assert await db.get_setting(0, models.SettingsType.CLIENT_TIMESTAMPS)
+
+
+@pytest.mark.asyncio
+async def test_insert_missing_settings(db: Database):
+    await db.insert_settings(0, models.Settings(use_channel=5))
+    inserted_ids = await db.insert_missing_settings({
+        guild_id: models.Settings(timezone="Europe/London") for guild_id in range(3)
+    })
+    assert inserted_ids == [1, 2]
+
+    # Existing settings are kept, and the cache matches the database
+    assert (await db.get_settings(0)).use_channel == 5
+    assert (await db.get_settings(0)).timezone == models.Settings().timezone
+    db.settings_cache.clear()
+    await db.load_all_settings()
+    assert await db.get_settings(1) == models.Settings(timezone="Europe/London")
+    assert await db.get_settings(2) == models.Settings(timezone="Europe/London")
+
+    assert await db.insert_missing_settings({1: models.Settings()}) == []
+
+
+@pytest.mark.asyncio
+async def test_connection_pool(db: Database):
+    # More concurrent calls than there are pooled connections
+    results = await asyncio.gather(*[db.exists_entry(0) for _ in range(db.pool.size * 3)])
+    assert not any(results)
+    assert db.pool.stats.acquisitions >= db.pool.size * 3
+    assert db.pool.stats.max_wait >= db.pool.stats.mean_wait()
+
+    # Calling init again (e.g. on reconnect) keeps the same pool open
+    await db.init()
+    assert db.pool.is_open()
+
+    await db.close()
+    assert not db.pool.is_open()
+    with pytest.raises(Exception):
+        await db.exists_entry(0)
+
+@pytest.mark.asyncio
+async def test_get_all_entries_multiple_servers(db: Database):
+    settings = [models.Settings(timezone="Europe/Stockholm"), models.Settings(timezone="Asia/Tokyo")]
+    entries = []
+    for server_id, server_settings in enumerate(settings):
+        await db.insert_settings(server_id, server_settings)
+        for i in range(3):
+            entry = models.Entry(
+                message_id = server_id * 10 + i,
+                channel_id = 0,
+                server_id = server_id,
+                game = "Testgame",
+                start_date = datetime.now(tz=server_settings.get_tzinfo()).replace(microsecond=0),
+                max_players = 4,
+                members = [models.Member(j, j + 1) for j in range(i)]
+            )
+            await db.insert_entry(entry)
+            entries.append(entry)
+
+    db_entries = await db.get_all_entries()
+    assert db_entries == entries
+    assert db_entries == [await db.get_entry(entry.message_id) for entry in entries]
+    assert await db.get_entries([12, 1, 99]) == [entries[1], entries[5]]
+    assert await db.get_entries([]) == []
+
+
+@pytest.mark.asyncio
+async def test_settings_cache(db: Database):
+    await db.insert_settings(0, models.Settings())
+    await db.edit_setting(0, models.SettingsType.CANCEL_DELAY, "12")
+
+    # Served from the cache, with the value converted like SQLite stores it
+    misses = db.settings_cache_stats.misses
+    assert await db.get_setting(0, models.SettingsType.CANCEL_DELAY) == 12
+    settings = await db.get_settings(0)
+    assert settings.cancel_delay == 12
+    assert db.settings_cache_stats.misses == misses
+    assert db.settings_cache_stats.hits >= 2
+
+    # Changing the returned object does not change the cached settings
+    settings.cancel_delay = 5
+    assert (await db.get_settings(0)).cancel_delay == 12
+
+    # Unknown guilds are looked up in the database
+    assert await db.get_settings(1) is None
+    assert db.settings_cache_stats.misses == misses + 1
+
+    # A new Database instance fills its cache at startup
+    other_db = Database(db.db_name)
+    await other_db.init()
+    assert other_db.settings_cache == {0: await db.get_settings(0)}
+    await other_db.close()
+
+@pytest.mark.asyncio
+async def test_wal_storage_profile(db_name: str):
+    db = Database(db_name, storage_profile=STORAGE_PROFILES["wal"])
+    await db.init()
+    async with db.pool.acquire() as conn:
+        cursor = await conn.execute("PRAGMA journal_mode")
+        assert (await cursor.fetchone())[0] == "wal"
+        cursor = await conn.execute("PRAGMA foreign_keys")
+        assert (await cursor.fetchone())[0] == 1
+    await db.insert_settings(0, models.Settings())
+    assert await db.get_settings(0) == models.Settings()
+    await db.close()
+
+@pytest.mark.asyncio
+async def test_write_queue_batches_member_writes(db: Database):
+    server_id = 0
+    settings = models.Settings()
+    await db.insert_settings(server_id, settings)
+    entry = models.Entry(
+        message_id = 0,
+        channel_id = 0,
+        server_id = server_id,
+        game = "Testgame",
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
+        max_players = 4
+    )
+    await db.insert_entry(entry)
+
+    batches = db.write_queue.num_batches
+    results = await asyncio.gather(
+        db.edit_or_insert_member(0, models.Member(0, 1)),
+        db.edit_or_insert_member(0, models.Member(0, 2)),
+        db.insert_member(0, models.Member(0, 3)),  # Fails, member 0 already exists
+        db.edit_or_insert_member(0, models.Member(1, 1)),
+        db.edit_or_insert_member(0, models.Member(0, 3)),
+        db.delete_member(0, 1),
+        return_exceptions=True
+    )
+
+    # Each caller gets its own result, in submission order
+    assert results[0] is None
+    assert results[1] == 1
+    assert isinstance(results[2], sqlite3.IntegrityError)
+    assert results[3] is None
+    assert results[4] == 2
+    assert results[5] is None
+    assert db.write_queue.num_batches == batches + 1
+
+    db_entry = await db.get_entry(0)
+    assert db_entry.members == [models.Member(0, 3)]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("profile", ["default", "wal"])
+async def test_write_queue_with_direct_writes(profile: str, db_name: str):
+    # Queued member writes must not fail with "database is locked" when
+    # other connections write entries and settings at the same time
+    db = Database(db_name, storage_profile=STORAGE_PROFILES[profile])
+    await db.init()
+    settings = models.Settings()
+    await db.insert_settings(0, settings)
+
+    def create_entry(message_id: int) -> models.Entry:
+        return models.Entry(
+            message_id=message_id,
+            channel_id=0,
+            server_id=0,
+            game="Testgame",
+            start_date=datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
+            max_players=4
+        )
+    await db.insert_entry(create_entry(0))
+
+    # Spread the writes out in time, so that the direct writes commit
+    # while batches of member writes are running
+    async def member_write(user_id: int):
+        await asyncio.sleep(user_id * 0.0005)
+        await db.edit_or_insert_member(0, models.Member(user_id, 1))
+
+    async def direct_writes(message_id: int):
+        await asyncio.sleep(message_id * 0.006)
+        await db.insert_entry(create_entry(message_id))
+        await db.edit_setting(0, models.SettingsType.CANCEL_DELAY, message_id)
+
+    results = await asyncio.gather(
+        *[member_write(user_id) for user_id in range(1000)],
+        *[direct_writes(message_id) for message_id in range(1, 81)],
+        return_exceptions=True
+    )
+    num_members = len((await db.get_entry(0)).members)
+    await db.close()
+    assert [r for r in results if isinstance(r, Exception)] == []
+    assert num_members == 1000
+
+@pytest.mark.asyncio
+async def test_get_due_entries(db: Database):
+    server_id = 0
+    settings = models.Settings()
+    await db.insert_settings(server_id, settings)
+    now = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0)
+    entry = models.Entry(
+        message_id = 0,
+        channel_id = 0,
+        server_id = server_id,
+        game = "Testgame",
+        start_date = now - timedelta(minutes=1),
+        max_players = 4,
+        members = [models.Member(0, 1)]
+    )
+    await db.insert_entry(entry)
+    await db.insert_entry(dataclasses.replace(entry, message_id=1, start_date=now, members=[]))
+    await db.insert_entry(dataclasses.replace(entry, message_id=2, start_date=now + timedelta(minutes=1), members=[models.Member(1, 1)]))
+
+    due_entries = await db.get_due_entries(now)
+    assert [e.message_id for e in due_entries] == [0, 1]
+    assert due_entries[0] == entry
+
+    # Any time zone refers to the same point in time
+    due_entries = await db.get_due_entries(now.astimezone(tz.gettz("Asia/Tokyo")) + timedelta(minutes=1))
+    assert len(due_entries) == 3
+    assert due_entries[2].members == [models.Member(1, 1)]
+
+@pytest.mark.asyncio
+async def test_archive_entry(db: Database):
+    server_id = 0
+    settings = models.Settings()
+    await db.insert_settings(server_id, settings)
+    entry = models.Entry(
+        message_id = 0,
+        channel_id = 0,
+        server_id = server_id,
+        game = "Testgame",
+        start_date = datetime.now(tz=settings.get_tzinfo()).replace(microsecond=0),
+        max_players = 4,
+        members = [models.Member(1, 2), models.Member(0, 1)]
+    )
+    await db.insert_entry(entry)
+    await db.insert_entry(dataclasses.replace(entry, message_id=1, members=[models.Member(2, 1)]))
+
+    await db.archive_entry(0, "finished")
+    assert await db.get_entry(0) is None
+    assert await db.get_archived_entry(0) == entry
+    assert [e.message_id for e in await db.get_all_entries()] == [1]
+
+    await db.archive_entries([1], "cancelled")
+    assert await db.get_all_entries() == []
+    async with db.pool.acquire() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM members")
+        assert (await cursor.fetchone())[0] == 0
+
+    # Nothing is older than the retention window
+    assert await db.prune_archive(datetime.now(tz=timezone.utc) - timedelta(days=1)) == 0
+    assert await db.get_archived_entry(1) is not None
+
+    assert await db.prune_archive(datetime.now(tz=timezone.utc) + timedelta(seconds=1), batch_size=1) == 2
+    assert await db.get_archived_entry(0) is None
+    async with db.pool.acquire() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM member_archive")
+        assert (await cursor.fetchone())[0] == 0
+        cursor = await conn.execute("PRAGMA auto_vacuum")
+        assert (await cursor.fetchone())[0] == 2
@@ -0,0 +1,93 @@
+import asyncio
+from time import time
+
+import pytest
+
+from teamo.database import Database
+from teamo.jobs import JobExecutor
+from teamo import models
+
+@pytest.mark.asyncio
+async def test_jobs_are_grouped_by_kind(db_name: str):
+    db = Database(db_name)
+    await db.init()
+    handled = {kind: [] for kind in models.JobKind}
+
+    async def handle_cancel(jobs):
+        handled[models.JobKind.CANCEL_ENTRY].append(jobs)
+
+    async def handle_delete(jobs):
+        handled[models.JobKind.DELETE_MESSAGE].append(jobs)
+        raise Exception("Failing handlers don't stop the executor")
+
+    executor = JobExecutor(db, {
+        models.JobKind.CANCEL_ENTRY: handle_cancel,
+        models.JobKind.DELETE_MESSAGE: handle_delete
+    })
+    await executor.schedule(models.JobKind.DELETE_MESSAGE, 1, 10, -1)
+    await executor.schedule(models.JobKind.DELETE_MESSAGE, 1, 11, 0)
+    await executor.schedule(models.JobKind.CANCEL_ENTRY, 1, 12, 0)
+    cancelled = await executor.schedule(models.JobKind.CANCEL_ENTRY, 1, 13, 0)
+    await executor.cancel(cancelled.job_id)
+
+    run_task = asyncio.create_task(executor.run())
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if len(await db.get_jobs()) == 0:
+            break
+    run_task.cancel()
+
+    assert [[job.message_id for job in jobs] for jobs in handled[models.JobKind.DELETE_MESSAGE]] == [[10, 11]]
+    assert [[job.message_id for job in jobs] for jobs in handled[models.JobKind.CANCEL_ENTRY]] == [[12]]
+    assert await db.get_jobs() == []
+    await db.close()
+
+@pytest.mark.asyncio
+async def test_jobs_survive_restart(db_name: str):
+    db = Database(db_name)
+    await db.init()
+    executor = JobExecutor(db, dict())
+    job = await executor.schedule(models.JobKind.DELETE_MESSAGE, 1, 10, 60)
+    assert job.due_at >= time() + 60
+    await db.close()
+
+    db = Database(db_name)
+    await db.init()
+    executor = JobExecutor(db, dict())
+    assert await executor.restore() == [job]
+    assert executor.scheduler.get_deadline(job.job_id) == job.due_at
+    await db.close()
+
+@pytest.mark.asyncio
+async def test_executor_survives_database_errors(db: Database, monkeypatch):
+    handled = []
+
+    async def handle_delete(jobs):
+        handled.extend(job.message_id for job in jobs)
+
+    executor = JobExecutor(db, {models.JobKind.DELETE_MESSAGE: handle_delete})
+    delete_jobs = db.delete_jobs
+
+    async def fail_once(job_ids):
+        monkeypatch.setattr(db, "delete_jobs", delete_jobs)
+        raise Exception("database is locked")
+
+    monkeypatch.setattr(db, "delete_jobs", fail_once)
+    await executor.schedule(models.JobKind.DELETE_MESSAGE, 1, 10, 0)
+    run_task = asyncio.create_task(executor.run())
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if len(handled) == 1:
+            break
+
+    # Jobs are still run after a failed delete
+    await executor.schedule(models.JobKind.DELETE_MESSAGE, 1, 11, 0)
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if len(handled) == 2 and len(await db.get_jobs()) == 1:
+            break
+    assert not run_task.done()
+    run_task.cancel()
+    assert handled == [10, 11]
+    # The job whose delete failed is kept, so it is run again after a restart
+    assert [job.message_id for job in await db.get_jobs()] == [10]
@@ -0,0 +1,99 @@
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+
+import pytest
+
+from teamo import migrations, models
+from teamo.database import Database
+
+
+@pytest.fixture
+def legacy_db_name():
+    ''' A database file with the schema used before migrations were tracked '''
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        db_name = f"{tmpdirname}/legacy.db"
+        conn = sqlite3.connect(db_name)
+        conn.execute('''CREATE TABLE entries (
+            entry_id integer primary key,
+            channel_id integer,
+            server_id integer,
+            game text,
+            start_date timestamp,
+            max_players integer
+            )''')
+        conn.execute('''CREATE TABLE members (
+            entry_id integer,
+            member_id integer,
+            num_players integer,
+            primary key (member_id, entry_id)
+            foreign key (entry_id) references entries (entry_id)
+            )''')
+        conn.execute('''CREATE TABLE settings (
+            guild_id integer primary key,
+            use_channel integer,
+            waiting_channel integer,
+            end_channel integer,
+            delete_general_delay integer,
+            delete_use_delay integer,
+            delete_end_delay integer,
+            cancel_delay integer,
+            timezone text
+            )''')
+        conn.execute("INSERT INTO settings VALUES (0, NULL, NULL, NULL, 30, 30, 3600, 30, 'Europe/Stockholm')")
+        conn.execute("INSERT INTO entries VALUES (0, 0, 0, 'Testgame', '2020-09-17 18:30:00', 5)")
+        conn.execute("INSERT INTO members VALUES (0, 2, 3)")
+        conn.execute("INSERT INTO members VALUES (0, 1, 1)")
+        # A member left behind by a deleted entry
+        conn.execute("INSERT INTO members VALUES (7, 1, 1)")
+        conn.commit()
+        conn.close()
+        yield db_name
+
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_database(legacy_db_name):
+    db = Database(legacy_db_name)
+    await db.init()
+
+    entry = await db.get_entry(0)
+    assert entry.start_date == datetime(2020, 9, 17, 18, 30, tzinfo=models.Settings().get_tzinfo())
+    assert entry.members == [models.Member(2, 3), models.Member(1, 1)]
+    assert await db.get_settings(0) == models.Settings()
+
+    # 18:30 in Stockholm summer time is 16:30 UTC
+    async with db.pool.acquire() as conn:
+        cursor = await conn.execute("SELECT start_date FROM entries WHERE entry_id=0")
+        assert (await cursor.fetchone())[0] == int(datetime(2020, 9, 17, 16, 30, tzinfo=timezone.utc).timestamp())
+
+    await db.delete_entry(0)
+    await db.close()
+
+    conn = sqlite3.connect(legacy_db_name)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == migrations.LATEST_VERSION
+    assert conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM members").fetchone()[0] == 0
+    indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+    assert "idx_members_entry_id" in indexes
+    assert "idx_entries_start_date" in indexes
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_migrate_is_idempotent(legacy_db_name):
+    for _ in range(2):
+        db = Database(legacy_db_name)
+        await db.init()
+        assert len(await db.get_all_entries()) == 1
+        await db.close()
+
+
+@pytest.mark.asyncio
+async def test_newer_schema_is_rejected(legacy_db_name):
+    conn = sqlite3.connect(legacy_db_name)
+    conn.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+    conn.close()
+
+    db = Database(legacy_db_name)
+    with pytest.raises(Exception):
+        await db.init()
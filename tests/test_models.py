@@ -0,0 +1,18 @@
+from teamo import models
+
+
+def test_reaction_state():
+    emojis = ["a", "b", "c"]
+    state = models.ReactionState.from_members(
+        [models.Member(0, 2), models.Member(1, 1)], emojis)
+    assert state.get_other_emojis(0, "b") == []
+
+    # A user switching number has the old reaction left until it is removed
+    state.add(0, "c")
+    assert state.get_other_emojis(0, "c") == ["b"]
+    state.remove(0, "b")
+    assert state.get_other_emojis(0, "c") == []
+
+    state.remove(1, "a")
+    state.remove(2, "a")
+    assert state.user_emojis == {0: {"c"}}
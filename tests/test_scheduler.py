@@ -0,0 +1,54 @@
+import asyncio
+from time import time
+
+import pytest
+
+from teamo.scheduler import DeadlineScheduler
+
+
+def test_pop_due():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule(0, 30)
+    scheduler.schedule(1, 10)
+    scheduler.schedule(2, 20)
+    scheduler.schedule(3, 5)
+
+    # Rescheduling replaces the deadline, unscheduling removes it
+    scheduler.schedule(2, 40)
+    scheduler.unschedule(3)
+    assert len(scheduler) == 3
+    assert scheduler.next_deadline() == 10
+
+    assert scheduler.pop_due(25) == [(1, 10)]
+    assert scheduler.pop_due(25) == []
+    assert scheduler.pop_due(40) == [(0, 30), (2, 40)]
+    assert len(scheduler) == 0
+    assert scheduler.next_deadline() is None
+
+
+@pytest.mark.asyncio
+async def test_wait_due():
+    scheduler = DeadlineScheduler()
+    now = time()
+    scheduler.schedule(0, now + 0.05)
+    scheduler.schedule(1, now - 1)
+
+    assert await scheduler.wait_due() == [(1, now - 1)]
+    due = await scheduler.wait_due()
+    assert due == [(0, now + 0.05)]
+    assert time() >= now + 0.05
+
+
+@pytest.mark.asyncio
+async def test_wait_due_wakes_up_on_schedule():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule(0, time() + 60)
+    waiter = asyncio.create_task(scheduler.wait_due())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+
+    # An earlier deadline is picked up without waiting for the later one
+    now = time()
+    scheduler.schedule(1, now)
+    assert await asyncio.wait_for(waiter, 1) == [(1, now)]
+    assert 0 in scheduler
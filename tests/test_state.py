@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from teamo import models
+from teamo.app import Teamo
+from teamo.state import EntryEvent, EntryEventKind, EntryRegistry, EntryState
+
+
+@pytest.mark.asyncio
+async def test_entry_registry():
+    batches = []
+
+    async def handler(entry_state, events):
+        batches.append((entry_state.handle.message_id, [event.kind for event in events]))
+
+    registry = EntryRegistry(handler)
+    entry_state = registry.add(EntryState(models.MessageHandle(channel_id=1, message_id=10)))
+    registry.add(EntryState(models.MessageHandle(channel_id=1, message_id=11)))
+    assert registry.get(10) is entry_state
+    assert 11 in registry
+    assert registry.num_live() == 2
+
+    entry_state.cancel_job_id = 5
+    assert entry_state.is_cancelling()
+
+    # Evicting an entry that is already gone doesn't count
+    assert registry.evict(10) is entry_state
+    assert registry.evict(10) is None
+    assert registry.get(10) is None
+    assert not registry.send(10, EntryEvent(EntryEventKind.REFRESH))
+    assert registry.num_live() == 1
+    assert registry.num_added == 2
+    assert registry.num_evicted == 1
+    await asyncio.wait_for(entry_state.task, 1)
+    assert batches == []
+
+    # Adding a new state for an active entry stops the actor of the old one
+    old_state = registry.get(11)
+    new_state = registry.add(EntryState(models.MessageHandle(channel_id=1, message_id=11)))
+    assert registry.get(11) is new_state
+    await asyncio.wait_for(old_state.task, 1)
+    assert not new_state.task.done()
+    assert registry.num_live() == registry.num_added - registry.num_evicted == 1
+
+
+@pytest.mark.asyncio
+async def test_entry_actor_batches_events():
+    batches = []
+    running = 0
+    max_running = 0
+
+    async def handler(entry_state, events):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        batches.append([event.user_id for event in events])
+        await asyncio.sleep(0.01)
+        running -= 1
+        if events[0].user_id == 0:
+            raise Exception("Failing batches don't stop the actor")
+
+    registry = EntryRegistry(handler)
+    entry_state = registry.add(EntryState(models.MessageHandle(channel_id=1, message_id=10)))
+    registry.send(10, EntryEvent(EntryEventKind.REACTION_ADD, user_id=0))
+    await asyncio.sleep(0)
+
+    # Events sent while a batch is running are run together afterwards
+    for user_id in range(1, 4):
+        registry.send(10, EntryEvent(EntryEventKind.REACTION_ADD, user_id=user_id))
+    assert entry_state.queue_depth() == 3
+    assert registry.max_queue_depth() == 3
+
+    # Events sent after the entry is evicted are never run
+    registry.evict(10)
+    entry_state.send(EntryEvent(EntryEventKind.REACTION_ADD, user_id=4))
+    await asyncio.wait_for(entry_state.task, 1)
+    assert batches == [[0], [1, 2, 3]]
+    assert max_running == 1
+
+
+class EventRecorder:
+    ''' Stands in for the Teamo cog when running Teamo.handle_entry_events,
+    recording what each event did '''
+
+    def __init__(self):
+        self.entries = EntryRegistry(self.handle_entry_events)
+        self.calls = []
+
+    async def handle_entry_events(self, entry_state, events):
+        await Teamo.handle_entry_events(self, entry_state, events)
+
+    async def handle_reaction_add(self, entry_state, user_id, emoji):
+        self.calls.append(("add", user_id))
+
+    async def handle_reaction_remove(self, entry_state, user_id, emoji):
+        # Removing the cancel emoji aborts the cancellation
+        entry_state.cancel_job_id = None
+        self.calls.append(("remove", user_id))
+
+    async def finish_entry(self, message_id, deadline):
+        self.calls.append(("finish", message_id))
+        self.entries.evict(message_id)
+
+    async def delete_entry(self, message_id, reason):
+        self.calls.append((reason, message_id))
+        self.entries.evict(message_id)
+
+    async def refresh_entry(self, message_id):
+        self.calls.append(("refresh", message_id))
+
+
+@pytest.mark.asyncio
+async def test_entry_events_run_in_order():
+    teamo = EventRecorder()
+    entry_state = teamo.entries.add(EntryState(models.MessageHandle(channel_id=1, message_id=10)))
+
+    # Reactions that arrived before the start time are run before the entry
+    # is finished, and events after it are dropped
+    for event in [
+        EntryEvent(EntryEventKind.REACTION_ADD, user_id=1),
+        EntryEvent(EntryEventKind.REFRESH),
+        EntryEvent(EntryEventKind.FINISH, deadline=0),
+        EntryEvent(EntryEventKind.REACTION_ADD, user_id=2),
+    ]:
+        entry_state.send(event)
+    await asyncio.wait_for(entry_state.task, 1)
+    assert teamo.calls == [("add", 1), ("finish", 10)]
+
+
+@pytest.mark.asyncio
+async def test_aborted_cancel_is_dropped():
+    teamo = EventRecorder()
+    entry_state = teamo.entries.add(EntryState(models.MessageHandle(channel_id=1, message_id=10), cancel_job_id=5))
+
+    # The cancellation is aborted before its job is handled
+    entry_state.send(EntryEvent(EntryEventKind.REACTION_REMOVE, user_id=1))
+    entry_state.send(EntryEvent(EntryEventKind.CANCEL, job_id=5))
+    entry_state.send(EntryEvent(EntryEventKind.REACTION_ADD, user_id=2))
+    await asyncio.sleep(0.01)
+    assert teamo.calls == [("remove", 1), ("add", 2)]
+    assert 10 in teamo.entries
+
+    # A CANCEL of an older cancellation doesn't end a newer one, but the
+    # pending cancellation does
+    entry_state.cancel_job_id = 6
+    entry_state.send(EntryEvent(EntryEventKind.CANCEL, job_id=5))
+    entry_state.send(EntryEvent(EntryEventKind.CANCEL, job_id=6))
+    entry_state.send(EntryEvent(EntryEventKind.REACTION_ADD, user_id=3))
+    await asyncio.wait_for(entry_state.task, 1)
+    assert teamo.calls == [("remove", 1), ("add", 2), ("cancelled", 10)]
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from teamo.database import Database
+from teamo.store import EntryStore
+from teamo import models
+
+def create_entry(message_id: int, server_id: int, settings: models.Settings) -> models.Entry:
+    return models.Entry(
+        message_id=message_id,
+        channel_id=0,
+        server_id=server_id,
+        game="Testgame",
+        start_date=datetime.now(tz=settings.get_tzinfo()) + timedelta(hours=1),
+        max_players=5
+    )
+
+@pytest.mark.asyncio
+async def test_store_writes_through(db: Database):
+    settings = models.Settings()
+    await db.insert_settings(0, settings)
+    await db.insert_settings(1, settings)
+    await db.insert_entry(create_entry(1, 0, settings))
+    entry_store = EntryStore(db)
+    assert len(await entry_store.load()) == 1
+
+    await entry_store.insert(create_entry(2, 0, settings))
+    await entry_store.insert(create_entry(3, 1, settings))
+    await entry_store.edit_or_insert_member(1, models.Member(10, 1))
+    await entry_store.edit_or_insert_member(1, models.Member(11, 2))
+    assert await entry_store.edit_or_insert_member(1, models.Member(10, 3)) == 1
+    await entry_store.edit_or_insert_member(2, models.Member(10, 1))
+    await entry_store.delete_member(2, 10)
+    await entry_store.archive(3, "cancelled")
+
+    assert entry_store.get(1).members == [models.Member(10, 3), models.Member(11, 2)]
+    assert entry_store.get(1) == await db.get_entry(1)
+    assert entry_store.get(2) == await db.get_entry(2)
+    assert entry_store.get(3) is None
+    assert entry_store.get_member(1, 11) == models.Member(11, 2)
+    assert [entry.message_id for entry in entry_store.get_server_entries(0)] == [1, 2]
+    assert await entry_store.check_consistency() == []
+
+    # Returned entries are copies
+    entry_store.get(1).members.clear()
+    assert len(entry_store.get(1).members) == 2
+
+@pytest.mark.asyncio
+async def test_store_consistency_check(db: Database):
+    settings = models.Settings()
+    await db.insert_settings(0, settings)
+    entry_store = EntryStore(db)
+    await entry_store.load()
+    await entry_store.insert(create_entry(1, 0, settings))
+    await entry_store.insert(create_entry(2, 0, settings))
+
+    # Writes that bypass the store are found
+    await db.insert_entry(create_entry(3, 0, settings))
+    await db.edit_or_insert_member(1, models.Member(10, 1))
+    await db.delete_entry(2)
+    differences = await entry_store.check_consistency()
+    assert len(differences) == 3
+
+@pytest.mark.asyncio
+async def test_store_set_server_timezone(db: Database):
+    settings = models.Settings()
+    await db.insert_settings(0, settings)
+    await db.insert_settings(1, settings)
+    entry_store = EntryStore(db)
+    await entry_store.load()
+    await entry_store.insert(create_entry(1, 0, settings))
+    await entry_store.insert(create_entry(2, 1, settings))
+    start_date = entry_store.get(1).start_date
+
+    await db.edit_setting(0, models.SettingsType.TIMEZONE, "Asia/Tokyo")
+    tokyo = (await db.get_settings(0)).get_tzinfo()
+    entry_store.set_server_timezone(0, tokyo)
+    assert entry_store.get(1).start_date.tzinfo == tokyo
+    assert entry_store.get(1).start_date == start_date
+    assert entry_store.get(2).start_date.tzinfo == settings.get_tzinfo()
+    assert await entry_store.check_consistency() == []
@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta
 from time import time
 import itertools
+from math import floor
 
 from dateutil import tz
 import pytest
 
-from teamo import utils
+from teamo import models, utils
 
 tznames = [
     "Europe/Stockholm",
@@ -56,3 +57,72 @@ timedelta_string_params = [
 def test_get_timedelta_string(td: timedelta, expected: str):
     td_str = utils.get_timedelta_string(td)
     assert td_str == expected
+
+
+next_refresh_delay_params = [
+    (timedelta(seconds=59), None),
+    (timedelta(seconds=60.5), 0.5),
+    (timedelta(minutes=12, seconds=10), 10),
+    (timedelta(hours=10, minutes=33, seconds=59), 59),
+    (timedelta(days=1, minutes=59, seconds=59), 59),
+    (timedelta(days=13, minutes=66, seconds=20), 20),
+]
+
+@pytest.mark.parametrize("td, expected", next_refresh_delay_params)
+def test_get_next_refresh_delay(td: timedelta, expected: float):
+    delay = utils.get_next_refresh_delay(td)
+    if expected is None:
+        assert delay is None
+        return
+    assert delay == pytest.approx(expected)
+
+    # The string changes right after the delay, but not right before it
+    before = utils.get_timedelta_string(td - timedelta(seconds=delay - 0.01))
+    after = utils.get_timedelta_string(td - timedelta(seconds=delay + 0.01))
+    assert before == utils.get_timedelta_string(td)
+    assert after != before
+
+    assert utils.get_next_refresh_delay(td, stagger=3) == pytest.approx(expected + 3)
+
+def test_get_refresh_stagger(monkeypatch):
+    monkeypatch.setenv("TEAMO_UPDATE_INTERVAL", "15")
+    staggers = [utils.get_refresh_stagger(message_id) for message_id in range(1000)]
+    assert all(0 <= stagger < 15 for stagger in staggers)
+    # Spread over the whole interval
+    assert len(set(floor(stagger) for stagger in staggers)) == 15
+
+def test_get_embed_fingerprint():
+    entry = models.Entry(
+        message_id=0,
+        channel_id=0,
+        server_id=0,
+        game="Test game",
+        start_date=datetime.now(tz=tz.gettz("Europe/Stockholm")) + timedelta(hours=1),
+        max_players=5
+    )
+    embed = utils.create_embed(entry)
+    fingerprint = utils.get_embed_fingerprint(embed)
+
+    # The footer is not part of the fingerprint
+    embed.set_footer(text="Last updated: never")
+    assert utils.get_embed_fingerprint(embed) == fingerprint
+    assert utils.get_embed_fingerprint(utils.create_embed(entry)) == fingerprint
+
+    entry.members.append(models.Member(0, 1))
+    assert utils.get_embed_fingerprint(utils.create_embed(entry)) != fingerprint
+    assert utils.get_embed_fingerprint(utils.create_embed(entry, 10, True)) != utils.get_embed_fingerprint(utils.create_embed(entry))
+
+def test_create_embed_client_timestamps():
+    start_date = datetime(2020, 9, 17, 18, 30, tzinfo=tz.gettz("Europe/Stockholm"))
+    entry = models.Entry(
+        message_id=0,
+        channel_id=0,
+        server_id=0,
+        game="Test game",
+        start_date=start_date,
+        max_players=5
+    )
+    embed = utils.create_embed(entry, client_timestamps=True)
+    timestamp = int(start_date.timestamp())
+    assert f"<t:{timestamp}:F>" in embed.description
+    assert embed.fields[0].value == f"<t:{timestamp}:R>"